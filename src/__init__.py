@@ -19,8 +19,22 @@ NOVELS_DIR.mkdir(exist_ok=True)
 UPLOAD_DIR.mkdir(exist_ok=True)
 VOICE_DIR.mkdir(exist_ok=True)
 
-from .novel_init import init_novel
-from .novel_parser import convert_novel_to_script
-from .character_manager import manage_characters
-from .voice_manager import sync_role_to_voice
-from .tts_generator import generate_tts_audio
\ No newline at end of file
+# 各功能函数按需导入，避免仅查询状态时也加载 openai、pydub、requests 等重量级依赖
+_LAZY_EXPORTS = {
+    "init_novel": ".novel_init",
+    "convert_novel_to_script": ".novel_parser",
+    "manage_characters": ".character_manager",
+    "sync_role_to_voice": ".voice_manager",
+    "generate_tts_audio": ".tts_generator",
+    "export_audiobook": ".book_exporter",
+    "rerender_line": ".line_rerender",
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_EXPORTS:
+        import importlib
+        value = getattr(importlib.import_module(_LAZY_EXPORTS[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,287 @@
+import json
+import struct
+import wave
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from . import CONFIG_DIR
+
+# 默认后处理参数，可在 config.json 的 "audio_postprocess" 字段中覆盖
+DEFAULT_POSTPROCESS_CONFIG = {
+    "frame_ms": 10,              # 静音检测的帧长
+    "trim_threshold_db": -45.0,  # 低于该电平（dBFS）的帧视为静音
+    "trim_pad_ms": 30,           # 裁剪后首尾保留的余量
+    "target_dbfs": -20.0,        # 每段有声部分的目标响度（RMS）
+    "max_gain_db": 15.0,         # 最大增益，避免把底噪放大
+    "peak_dbfs": -1.0,           # 峰值上限
+    "gap_ms": {
+        "sentence": 400,         # 上一句以 。！？… 结尾
+        "clause": 200,           # 上一句以 ，、； 结尾
+        "colon": 120,            # 上一句以 ： 结尾（如“说道：”后紧接台词）
+        "default": 300,
+        "role_change": 250,      # 换角色时额外增加的停顿
+        "end": 800               # 章节末尾
+    }
+}
+
+SENTENCE_END = set("。！？!?…")
+CLAUSE_END = set("，、；,;")
+COLON_END = set("：:")
+CLOSING_MARKS = "”’」』》）)\"' \t　"
+
+_EPS = 1e-10
+
+# 整章音频中每行的采样偏移索引，与 full_drama.wav 位于同一目录
+SEGMENT_INDEX_NAME = "segment_index.json"
+
+
+def load_postprocess_config() -> dict:
+    """读取 config.json 中的 audio_postprocess 配置，并与默认值合并"""
+    cfg = json.loads(json.dumps(DEFAULT_POSTPROCESS_CONFIG))
+    if CONFIG_DIR.exists():
+        with open(CONFIG_DIR, "r", encoding="utf-8") as f:
+            user_cfg = json.load(f).get("audio_postprocess", {})
+        gap_cfg = user_cfg.pop("gap_ms", {})
+        cfg.update(user_cfg)
+        cfg["gap_ms"].update(gap_cfg)
+    return cfg
+
+
+def _read_wav_header(path: Path) -> Tuple[str, int, int, int, int]:
+    """
+    解析 WAV 头，返回 (numpy dtype, 声道数, 采样率, data 块偏移, data 块字节数)
+    """
+    with open(path, "rb") as f:
+        riff, _, wave_id = struct.unpack("<4sI4s", f.read(12))
+        if riff != b"RIFF" or wave_id != b"WAVE":
+            raise ValueError(f"不是有效的 WAV 文件: {path}")
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                break
+            chunk_id, chunk_size = struct.unpack("<4sI", header)
+            if chunk_id == b"fmt ":
+                body = f.read(chunk_size)
+                fmt_tag, channels, sample_rate, _, _, bits = struct.unpack("<HHIIHH", body[:16])
+                if fmt_tag == 0xFFFE and len(body) >= 26:  # WAVE_FORMAT_EXTENSIBLE
+                    fmt_tag = struct.unpack("<H", body[24:26])[0]
+                fmt = (fmt_tag, channels, sample_rate, bits)
+            elif chunk_id == b"data":
+                if fmt is None:
+                    raise ValueError(f"WAV 缺少 fmt 块: {path}")
+                fmt_tag, channels, sample_rate, bits = fmt
+                if fmt_tag == 1 and bits == 16:
+                    dtype = "<i2"
+                elif fmt_tag == 1 and bits == 32:
+                    dtype = "<i4"
+                elif fmt_tag == 3 and bits == 32:
+                    dtype = "<f4"
+                else:
+                    raise ValueError(f"不支持的 WAV 格式 (format={fmt_tag}, bits={bits}): {path}")
+                # 部分写入器会把流式 data 大小写成 0 或 0xFFFFFFFF，以文件实际长度为准
+                data_size = min(chunk_size, path.stat().st_size - f.tell())
+                return dtype, channels, sample_rate, f.tell(), data_size
+            else:
+                f.seek(chunk_size + (chunk_size & 1), 1)
+    raise ValueError(f"WAV 缺少 data 块: {path}")
+
+
+def load_segment(path: Path) -> Tuple[np.ndarray, int]:
+    """
+    以内存映射方式读取 WAV，返回 (float32 样本数组 [帧数, 声道数], 采样率)，幅值范围 [-1, 1]
+    """
+    path = Path(path)
+    dtype, channels, sample_rate, offset, data_size = _read_wav_header(path)
+    itemsize = np.dtype(dtype).itemsize
+    n_frames = data_size // (itemsize * channels)
+    if n_frames == 0:
+        return np.zeros((0, channels), dtype=np.float32), sample_rate
+    raw = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(n_frames, channels))
+    if dtype == "<f4":
+        return np.asarray(raw, dtype=np.float32), sample_rate
+    scale = float(2 ** (8 * itemsize - 1))
+    return raw.astype(np.float32) / scale, sample_rate
+
+
+def frame_levels_db(samples: np.ndarray, sample_rate: int, frame_ms: int) -> np.ndarray:
+    """按帧计算 RMS 电平（dBFS），末尾不足一帧的部分单独作为一帧"""
+    frame_len = max(1, int(sample_rate * frame_ms / 1000))
+    n_full = len(samples) // frame_len
+    power = np.square(samples, dtype=np.float32).mean(axis=1)
+    levels = power[:n_full * frame_len].reshape(n_full, frame_len).mean(axis=1)
+    if len(samples) % frame_len:
+        levels = np.append(levels, power[n_full * frame_len:].mean())
+    return 10.0 * np.log10(levels + _EPS)
+
+
+def trim_silence(samples: np.ndarray, sample_rate: int, cfg: dict) -> np.ndarray:
+    """裁掉首尾静音，保留 trim_pad_ms 的余量；整段静音时返回空数组"""
+    if len(samples) == 0:
+        return samples
+    frame_len = max(1, int(sample_rate * cfg["frame_ms"] / 1000))
+    active = np.flatnonzero(frame_levels_db(samples, sample_rate, cfg["frame_ms"]) > cfg["trim_threshold_db"])
+    if active.size == 0:
+        return samples[:0]
+    pad = int(sample_rate * cfg["trim_pad_ms"] / 1000)
+    start = max(0, active[0] * frame_len - pad)
+    end = min(len(samples), (active[-1] + 1) * frame_len + pad)
+    return samples[start:end]
+
+
+def normalize_loudness(samples: np.ndarray, sample_rate: int, cfg: dict) -> np.ndarray:
+    """
+    将有声帧的平均 RMS 调整到 target_dbfs，增益不超过 max_gain_db，且峰值不超过 peak_dbfs
+    """
+    if len(samples) == 0:
+        return samples
+    levels = frame_levels_db(samples, sample_rate, cfg["frame_ms"])
+    voiced = levels[levels > cfg["trim_threshold_db"]]
+    if voiced.size == 0:
+        return samples
+    current_db = 10.0 * np.log10(np.mean(np.power(10.0, voiced / 10.0)) + _EPS)
+    gain_db = min(cfg["target_dbfs"] - current_db, cfg["max_gain_db"])
+    peak = float(np.max(np.abs(samples)))
+    if peak > 0:
+        gain_db = min(gain_db, cfg["peak_dbfs"] - 20.0 * np.log10(peak))
+    return samples * np.float32(10.0 ** (gain_db / 20.0))
+
+
+def compute_gap_ms(line: dict, next_line: Optional[dict], cfg: dict) -> int:
+    """根据上一句结尾标点和是否换角色计算两段之间的停顿时长"""
+    gaps = cfg["gap_ms"]
+    if next_line is None:
+        return gaps["end"]
+    text = line.get("text", "").rstrip(CLOSING_MARKS)
+    last = text[-1] if text else ""
+    if last in SENTENCE_END:
+        gap = gaps["sentence"]
+    elif last in CLAUSE_END:
+        gap = gaps["clause"]
+    elif last in COLON_END:
+        gap = gaps["colon"]
+    else:
+        gap = gaps["default"]
+    if line.get("role") != next_line.get("role"):
+        gap += gaps["role_change"]
+    return gap
+
+
+def _to_pcm16(samples: np.ndarray) -> bytes:
+    return (np.clip(samples, -1.0, 1.0) * 32767.0).astype("<i2").tobytes()
+
+
+def process_segment(path: Path, cfg: dict) -> Tuple[np.ndarray, int]:
+    """读取单个片段并裁剪静音、响度归一化"""
+    samples, sr = load_segment(path)
+    return normalize_loudness(trim_silence(samples, sr, cfg), sr, cfg), sr
+
+
+def assemble_chapter(
+    segment_paths: List[Path],
+    lines: List[dict],
+    output_path: Path,
+    cfg: Optional[dict] = None
+) -> Dict:
+    """
+    逐段裁剪静音、响度归一化后按智能停顿拼接为 16-bit PCM WAV，
+    边处理边写入，不在内存中保留整章音频。
+    返回 {"sample_rate", "channels", "total_frames", "segments": [{"start", "end", "gap"}]}，
+    偏移以采样帧计，gap 为该行之后的停顿长度
+    """
+    if not segment_paths:
+        raise ValueError("没有可拼接的音频片段")
+    if len(segment_paths) != len(lines):
+        raise ValueError("音频片段数量与剧本行数不一致")
+    if cfg is None:
+        cfg = load_postprocess_config()
+
+    offsets = []
+    sample_rate = channels = None
+    position = 0
+    with wave.open(str(output_path), "wb") as out:
+        for i, (path, line) in enumerate(zip(segment_paths, lines)):
+            samples, sr = process_segment(path, cfg)
+            if sample_rate is None:
+                sample_rate, channels = sr, samples.shape[1]
+                out.setnchannels(channels)
+                out.setsampwidth(2)
+                out.setframerate(sample_rate)
+            elif sr != sample_rate or samples.shape[1] != channels:
+                raise ValueError(f"音频片段格式不一致: {path} ({sr} Hz, {samples.shape[1]} 声道)")
+
+            out.writeframes(_to_pcm16(samples))
+            next_line = lines[i + 1] if i + 1 < len(lines) else None
+            gap_frames = int(sample_rate * compute_gap_ms(line, next_line, cfg) / 1000)
+            out.writeframes(b"\x00\x00" * channels * gap_frames)
+            offsets.append({"start": position, "end": position + len(samples), "gap": gap_frames})
+            position += len(samples) + gap_frames
+
+    return {"sample_rate": sample_rate, "channels": channels, "total_frames": position, "segments": offsets}
+
+
+def save_segment_index(path: Path, index: Dict):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+
+
+def load_segment_index(path: Path) -> Dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _move_bytes(f, src: int, dst: int, length: int, chunk_size: int = 1 << 20):
+    """在同一文件内移动一段字节（区间可重叠），向后移动时从尾部开始复制"""
+    if src == dst or length <= 0:
+        return
+    if dst > src:
+        pos = length
+        while pos > 0:
+            n = min(chunk_size, pos)
+            pos -= n
+            f.seek(src + pos)
+            data = f.read(n)
+            f.seek(dst + pos)
+            f.write(data)
+    else:
+        pos = 0
+        while pos < length:
+            n = min(chunk_size, length - pos)
+            f.seek(src + pos)
+            data = f.read(n)
+            f.seek(dst + pos)
+            f.write(data)
+            pos += n
+
+
+def splice_frames(wav_path: Path, start: int, end: int, pcm: bytes) -> int:
+    """
+    用 pcm（16-bit PCM 字节）替换 WAV 中 [start, end) 的采样帧。
+    长度相同时原位覆盖；否则只平移其后的数据并更新 WAV 头，返回长度变化的帧数
+    """
+    wav_path = Path(wav_path)
+    dtype, channels, _, data_offset, data_size = _read_wav_header(wav_path)
+    if dtype != "<i2":
+        raise ValueError(f"仅支持 16-bit PCM 的整章音频: {wav_path}")
+    frame_bytes = 2 * channels
+    if len(pcm) % frame_bytes:
+        raise ValueError("替换数据不是完整的采样帧")
+    region_start = data_offset + start * frame_bytes
+    region_end = data_offset + end * frame_bytes
+    if not data_offset <= region_start <= region_end <= data_offset + data_size:
+        raise ValueError(f"替换区间超出音频范围: [{start}, {end})")
+
+    delta = len(pcm) - (region_end - region_start)
+    file_size = wav_path.stat().st_size
+    with open(wav_path, "r+b") as f:
+        if delta:
+            _move_bytes(f, region_end, region_end + delta, file_size - region_end)
+        f.seek(region_start)
+        f.write(pcm)
+        if delta:
+            f.truncate(file_size + delta)
+            f.seek(data_offset - 4)
+            f.write(struct.pack("<I", data_size + delta))
+            f.seek(4)
+            f.write(struct.pack("<I", file_size + delta - 8))
+    return delta // frame_bytes
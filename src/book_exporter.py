@@ -0,0 +1,280 @@
+import json
+import re
+import shutil
+import subprocess
+import wave
+from pathlib import Path
+from typing import Dict, List, Optional
+from . import NOVELS_DIR
+
+# 导出格式 -> (编码参数, 分片后缀, 最终容器的 ffmpeg muxer)
+# 分片后缀为 None 的格式不缓存分片：flac 的 STREAMINFO（总采样数、MD5）与帧号在分片直接拼接后会错误，
+# 因此整本书从各章 WAV 一次性流式编码
+EXPORT_FORMATS = {
+    "m4b": (["-c:a", "aac", "-b:a", "64k"], ".m4a", "mp4"),
+    "mka": (["-c:a", "flac"], ".flac", "matroska"),
+    "flac": (["-c:a", "flac"], None, "flac"),
+    "wav": (None, None, None),
+}
+
+COPY_BLOCK_FRAMES = 1 << 16
+# RIFF/WAV 的大小字段为 32 位，数据超过约 4 GiB 时无法写成标准 WAV
+WAV_MAX_BYTES = 0xFFFFFFFF - 36
+
+
+def natural_sort_key(s: str):
+    return [int(t) if t.isdigit() else t.lower() for t in re.split(r'(\d+)', s)]
+
+
+def load_chapter_titles(novel_name: str) -> Dict[str, str]:
+    """读取初始化时写入的 chapters.json（处理单元 -> 原章节标题），不存在时返回空字典"""
+    manifest_path = NOVELS_DIR / novel_name / "chapters.json"
+    if not manifest_path.exists():
+        return {}
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return {entry["chapter_id"]: entry["title"] for entry in json.load(f)}
+
+
+def read_chapter_title(chapter_dir: Path) -> str:
+    """章节标题取 raw.txt 的第一行，缺失时用章节目录名"""
+    raw_path = chapter_dir / "raw.txt"
+    if raw_path.exists():
+        with open(raw_path, "r", encoding="utf-8") as f:
+            title = f.readline().strip()
+        if title:
+            return title
+    return chapter_dir.name
+
+
+def collect_chapters(novel_name: str) -> List[Dict]:
+    """按章节顺序收集已生成音频的章节信息（标题、音频路径、时长、指纹）"""
+    chapters_dir = NOVELS_DIR / novel_name / "chapters"
+    if not chapters_dir.exists():
+        raise FileNotFoundError(f"未找到章节目录: {chapters_dir}")
+
+    titles = load_chapter_titles(novel_name)
+    chapters = []
+    for ch_id in sorted((d.name for d in chapters_dir.iterdir() if d.is_dir()), key=natural_sort_key):
+        ch_dir = chapters_dir / ch_id
+        audio_path = ch_dir / "full_drama.wav"
+        if not audio_path.exists():
+            print(f"⚠️ 跳过未生成音频的章节: {ch_id}")
+            continue
+        with wave.open(str(audio_path), "rb") as w:
+            sample_rate, channels, n_frames = w.getframerate(), w.getnchannels(), w.getnframes()
+        stat = audio_path.stat()
+        chapters.append({
+            "chapter_id": ch_id,
+            "title": titles.get(ch_id) or read_chapter_title(ch_dir),
+            "audio": str(audio_path),
+            "sample_rate": sample_rate,
+            "channels": channels,
+            "frames": n_frames,
+            "duration_ms": n_frames * 1000 // sample_rate,
+            "fingerprint": f"{stat.st_size}-{stat.st_mtime_ns}"
+        })
+    if not chapters:
+        raise ValueError(f"小说 [{novel_name}] 没有任何已生成音频的章节")
+    return chapters
+
+
+def _escape_ffmetadata(value: str) -> str:
+    return re.sub(r"([=;#\\\n])", r"\\\1", value)
+
+
+def _marker_duration_ms(ch: Dict) -> int:
+    """章节标记使用编码后分片的实际时长（含编码器引入的前置与补齐），没有分片时使用 WAV 时长"""
+    return ch.get("part_duration_ms", ch["duration_ms"])
+
+
+def write_ffmetadata(path: Path, book_title: str, chapters: List[Dict]):
+    lines = [";FFMETADATA1", f"title={_escape_ffmetadata(book_title)}"]
+    start = 0
+    for ch in chapters:
+        end = start + _marker_duration_ms(ch)
+        lines += [
+            "[CHAPTER]",
+            "TIMEBASE=1/1000",
+            f"START={start}",
+            f"END={end}",
+            f"title={_escape_ffmetadata(ch['title'])}"
+        ]
+        start = end
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def write_cue_sheet(path: Path, audio_path: Path, book_title: str, chapters: List[Dict]):
+    """写入 CUE 索引（时间格式 mm:ss:ff，每秒 75 帧）"""
+    file_type = "WAVE" if audio_path.suffix == ".wav" else audio_path.suffix.lstrip(".").upper()
+    lines = [f'TITLE "{book_title}"', f'FILE "{audio_path.name}" {file_type}']
+    start = 0
+    for n, ch in enumerate(chapters, start=1):
+        cue_frames = start * 75 // 1000
+        minutes, rest = divmod(cue_frames, 75 * 60)
+        seconds, frames = divmod(rest, 75)
+        lines += [
+            f"  TRACK {n:02d} AUDIO",
+            f'    TITLE "{ch["title"].replace(chr(34), chr(39))}"',
+            f"    INDEX 01 {minutes:02d}:{seconds:02d}:{frames:02d}"
+        ]
+        start += _marker_duration_ms(ch)
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def _stream_wav_concat(chapters: List[Dict], output_path: Path):
+    """逐块拷贝各章 PCM 数据到一个 WAV 中，任意时刻只持有一个数据块"""
+    first = chapters[0]
+    with wave.open(str(output_path), "wb") as out:
+        out.setnchannels(first["channels"])
+        out.setsampwidth(2)
+        out.setframerate(first["sample_rate"])
+        for ch in chapters:
+            with wave.open(ch["audio"], "rb") as src:
+                if (src.getframerate(), src.getnchannels(), src.getsampwidth()) != \
+                        (first["sample_rate"], first["channels"], 2):
+                    raise ValueError(f"章节音频格式不一致，无法直接拼接为 WAV: {ch['audio']}")
+                while True:
+                    block = src.readframes(COPY_BLOCK_FRAMES)
+                    if not block:
+                        break
+                    out.writeframes(block)
+
+
+def _write_concat_list(path: Path, files: List[str]):
+    path.write_text("".join(f"file '{Path(p).as_posix()}'\n" for p in files), encoding="utf-8")
+
+
+def _run_ffmpeg(args: List[str]):
+    subprocess.run(["ffmpeg", "-y", "-v", "error", *args], check=True)
+
+
+def probe_duration_ms(path: Path) -> int:
+    """用 ffprobe 读取文件的实际时长（毫秒），与 concat 拼接时各分片的时间偏移一致"""
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1",
+         str(path)],
+        check=True, capture_output=True, text=True
+    )
+    return int(round(float(result.stdout.strip()) * 1000))
+
+
+def export_audiobook(
+    novel_name: str,
+    fmt: str = "m4b",
+    output_path: Optional[str] = None,
+    incremental: bool = True
+) -> str:
+    """
+    将整本小说的各章 full_drama.wav 按章节顺序导出为一个带章节标记的有声书：
+    m4b/mka 内嵌章节，flac/wav 附带 .cue 索引。
+
+    m4b/mka 每章先单独编码为分片并缓存在 export/parts/ 下，最终文件由分片流式拼接（不重新编码），
+    incremental=True 时只重新编码音频发生变化的章节；flac 由各章 WAV 流式拼接后一次性编码，
+    wav 直接逐块拷贝。任何时刻都不会在内存中持有超过一章的音频。
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"不支持的导出格式: {fmt}（可选: {', '.join(EXPORT_FORMATS)}）")
+    codec_args, part_suffix, muxer = EXPORT_FORMATS[fmt]
+    if muxer and shutil.which("ffmpeg") is None:
+        raise RuntimeError(f"导出 {fmt} 需要 ffmpeg，请先安装并加入 PATH")
+    if part_suffix and shutil.which("ffprobe") is None:
+        raise RuntimeError(f"导出 {fmt} 需要 ffprobe（随 ffmpeg 安装），请先安装并加入 PATH")
+
+    novel_dir = NOVELS_DIR / novel_name
+    export_dir = novel_dir / "export"
+    parts_dir = export_dir / "parts"
+    parts_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = export_dir / "manifest.json"
+    output = Path(output_path) if output_path else export_dir / f"{novel_name}.{fmt}"
+
+    chapters = collect_chapters(novel_name)
+    if muxer is None:
+        data_bytes = sum(ch["frames"] * ch["channels"] * 2 for ch in chapters)
+        if data_bytes > WAV_MAX_BYTES:
+            raise ValueError(
+                f"整本音频约 {data_bytes / (1 << 30):.1f} GiB，超出 WAV 格式 4 GiB 的上限，请改用 flac 或 m4b 导出"
+            )
+
+    previous = {}
+    if incremental and manifest_path.exists():
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("format") == fmt:
+            previous = {ch["chapter_id"]: ch for ch in manifest["chapters"]}
+
+    changed = [ch for ch in chapters if previous.get(ch["chapter_id"], {}).get("fingerprint") != ch["fingerprint"]]
+    unchanged_layout = [ch["chapter_id"] for ch in chapters] == list(previous) and \
+        all(ch["title"] == previous[ch["chapter_id"]]["title"] for ch in chapters)
+    if incremental and not changed and unchanged_layout and output.exists():
+        print(f"ℹ️ 所有章节音频均未变化，跳过导出: {output}")
+        return str(output)
+
+    print(f"📚 共 {len(chapters)} 章，需重新编码 {len(changed) if part_suffix else len(chapters)} 章")
+
+    if muxer is None:
+        _stream_wav_concat(chapters, output)
+    elif part_suffix is None:
+        # 无损格式没有编码延迟，章节标记直接使用 WAV 时长；concat 分离器要求各章格式一致
+        first = chapters[0]
+        for ch in chapters:
+            if (ch["sample_rate"], ch["channels"]) != (first["sample_rate"], first["channels"]):
+                raise ValueError(f"章节音频格式不一致，无法直接拼接为 {fmt}: {ch['audio']}")
+        concat_list = export_dir / "concat.txt"
+        _write_concat_list(concat_list, [ch["audio"] for ch in chapters])
+        metadata_path = export_dir / "ffmetadata.txt"
+        write_ffmetadata(metadata_path, novel_name, chapters)
+        print(f"🎧 编码整本音频: {output.name}")
+        _run_ffmpeg(["-f", "concat", "-safe", "0", "-i", str(concat_list), "-i", str(metadata_path),
+                     "-map", "0:a", "-map_metadata", "1", "-map_chapters", "1",
+                     *codec_args, "-f", muxer, str(output)])
+    else:
+        sample_rate, channels = chapters[0]["sample_rate"], chapters[0]["channels"]
+        for ch in chapters:
+            part = parts_dir / f"{ch['chapter_id']}{part_suffix}"
+            ch["part"] = str(part)
+            cached = previous.get(ch["chapter_id"], {})
+            if ch in changed or not part.exists():
+                print(f"🎧 编码章节 {ch['chapter_id']}: {ch['title']}")
+                _run_ffmpeg(["-i", ch["audio"], "-ar", str(sample_rate), "-ac", str(channels),
+                             *codec_args, str(part)])
+                ch["part_duration_ms"] = probe_duration_ms(part)
+            elif "part_duration_ms" in cached:
+                ch["part_duration_ms"] = cached["part_duration_ms"]
+            else:
+                ch["part_duration_ms"] = probe_duration_ms(part)
+
+        concat_list = export_dir / "concat.txt"
+        _write_concat_list(concat_list, [ch["part"] for ch in chapters])
+        metadata_path = export_dir / "ffmetadata.txt"
+        write_ffmetadata(metadata_path, novel_name, chapters)
+        _run_ffmpeg(["-f", "concat", "-safe", "0", "-i", str(concat_list), "-i", str(metadata_path),
+                     "-map", "0:a", "-map_metadata", "1", "-map_chapters", "1",
+                     "-c", "copy", "-f", muxer, str(output)])
+
+    if fmt in ("flac", "wav"):
+        write_cue_sheet(output.with_suffix(".cue"), output, novel_name, chapters)
+
+    # 清理已不存在章节的分片
+    if part_suffix:
+        current_parts = {ch["part"] for ch in chapters}
+        for part in parts_dir.iterdir():
+            if str(part) not in current_parts:
+                part.unlink()
+
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump({"format": fmt, "output": str(output), "chapters": chapters}, f, ensure_ascii=False, indent=2)
+
+    print(f"✅ 有声书导出完成: {output}")
+    return str(output)
+
+
+# ====== CLI 入口 ======
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="将整本小说导出为带章节标记的有声书")
+    parser.add_argument("--novel", required=True)
+    parser.add_argument("--format", default="m4b", choices=list(EXPORT_FORMATS))
+    parser.add_argument("--output", help="输出路径（默认 data/novels/{novel}/export/{novel}.{format}）")
+    parser.add_argument("--full", action="store_true", help="忽略缓存，重新编码全部章节")
+    args = parser.parse_args()
+    export_audiobook(args.novel, fmt=args.format, output_path=args.output, incremental=not args.full)
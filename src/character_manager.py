@@ -3,6 +3,8 @@ import re
 from pathlib import Path
 from openai import OpenAI
 from . import CONFIG_DIR, NOVELS_DIR
+from .usage_ledger import STAGE_PROFILE, BudgetExceeded, check_budget, record_completion
+from .role_alias import PERSISTENT_RULES, load_alias_index, match_role, save_alias_index, update_hints_from_chapter
 
 def load_config():
     with open(CONFIG_DIR, "r", encoding="utf-8") as f:
@@ -22,7 +24,7 @@ def get_all_roles_from_script(novel_name: str, chapter_id: str):
             seen.add(role)
     return roles
 
-def generate_character_profile(novel_name: str, new_role: str, context_snippet: str = "") -> dict:
+def generate_character_profile(novel_name: str, new_role: str, context_snippet: str = "", chapter_id: str = None) -> dict:
     """
     调用 LLM 为新角色生成性格档案
     """
@@ -44,12 +46,14 @@ def generate_character_profile(novel_name: str, new_role: str, context_snippet:
 不要包含任何额外字段、解释、注释或格式，只输出合法 JSON。
 """
 
+    check_budget(novel_name)
     completion = client.chat.completions.create(
         model=llm_cfg["model"],
         messages=[{"role": "user", "content": prompt}],
         #temperature=0.5,
         max_tokens=5120
     )
+    record_completion(novel_name, chapter_id, STAGE_PROFILE, llm_cfg["model"], completion)
     response = completion.choices[0].message.content
 
     # 提取 JSON
@@ -88,15 +92,50 @@ def manage_characters(novel_name: str, chapter_id: str):
 
     # 获取本章节所有角色（按首次出现顺序）
     all_roles = get_all_roles_from_script(novel_name, chapter_id)
-    new_roles = [role for role in all_roles if role not in existing_roles]
+    unknown_roles = [role for role in all_roles if role not in existing_roles]
+
+    # 先查别名索引，已有角色的别称不再生成档案和音色；
+    # 包含全名、姓+称谓、模糊匹配得到的别名只在本次使用（TTS 时会重新解析），不写入 aliases.json
+    alias_index = load_alias_index(novel_name)
+    update_hints_from_chapter(novel_name, chapter_id, alias_index, list(existing_roles))
+    new_roles = []
+    pending_aliases = {}
+    for role in unknown_roles:
+        char, rule = match_role(role, characters, alias_index)
+        if char is not None and char.get("id") is not None:
+            if rule in PERSISTENT_RULES:
+                alias_index["aliases"][role] = char["id"]
+            print(f"🔗 '{role}' 识别为 '{char['role']}' 的别名（{rule}），跳过档案生成")
+            continue
+        new_roles.append(role)
+
+    # 同一章中新出现的称呼之间也可能互为别名（如“韩兄”与“韩立”），只为规范名生成档案
+    # 反复解析直到不再变化：先确定的别名会从候选中移除，使“姓+称谓”等规则不再因同姓别称而产生歧义
+    candidates = [{"role": role} for role in new_roles]
+    changed = True
+    while changed:
+        changed = False
+        for cand in candidates:
+            if cand["role"] in pending_aliases:
+                continue
+            others = [c for c in candidates if c is not cand and c["role"] not in pending_aliases]
+            target, rule = match_role(cand["role"], others, alias_index)
+            if target is not None:
+                pending_aliases[cand["role"]] = (target["role"], rule)
+                changed = True
+    new_roles = [role for role in new_roles if role not in pending_aliases]
 
     if not new_roles:
+        save_alias_index(novel_name, alias_index)
         print("✅ 无新角色，角色库无需更新")
         return str(CHARACTERS_PATH)
 
     print(f"🔍 发现 {len(new_roles)} 个新角色: {new_roles}")
 
     # 为每个新角色生成档案
+    # 达到用量预算时停止生成，但已生成（已付费）的档案照常保存
+    created_ids = {}
+    budget_error = None
     for role in new_roles:
         # 可选：提取该角色在 script.json 中的前几句作为上下文
         context_lines = []
@@ -109,17 +148,36 @@ def manage_characters(novel_name: str, chapter_id: str):
         if not raw_text:
             raise ValueError(f"{raw_txt_path} 内容为空")
 
-        profile = generate_character_profile(novel_name, role, raw_text)
+        try:
+            profile = generate_character_profile(novel_name, role, raw_text, chapter_id)
+        except BudgetExceeded as e:
+            budget_error = e
+            break
         profile["id"] = next_id
+        created_ids[role] = next_id
         next_id += 1
         characters.append(profile)
         print(f"✨ 已生成角色档案: {role}")
 
+    for alias, (target, rule) in pending_aliases.items():
+        persistent = rule in PERSISTENT_RULES
+        while target in pending_aliases:
+            target, rule = pending_aliases[target]
+            persistent = persistent and rule in PERSISTENT_RULES
+        if target not in created_ids:
+            continue
+        if persistent:
+            alias_index["aliases"][alias] = created_ids[target]
+        print(f"🔗 '{alias}' 识别为 '{target}' 的别名，跳过档案生成")
+    save_alias_index(novel_name, alias_index)
+
     # 保存
     with open(CHARACTERS_PATH, "w", encoding="utf-8") as f:
         json.dump(characters, f, ensure_ascii=False, indent=2)
 
     print(f"✅ 角色库已更新: {CHARACTERS_PATH}")
+    if budget_error is not None:
+        raise budget_error
     return str(CHARACTERS_PATH)
 
 
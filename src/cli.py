@@ -0,0 +1,402 @@
+"""
+ainovelcast 统一命令行入口
+
+重量级依赖（openai、pydub、requests、charset_normalizer 等）只在对应子命令真正执行时才导入，
+status 等查询命令只依赖标准库。
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+from . import NOVELS_DIR
+from .book_exporter import load_chapter_titles, natural_sort_key
+
+DEFAULT_CHAPTER_PATTERN = r"^[ \t\u3000]*(?:第)?[零一二三四五六七八九十百千\d]{1,10}[章话节]"
+
+
+def list_chapters(novel_name: str) -> List[str]:
+    chapters_dir = NOVELS_DIR / novel_name / "chapters"
+    if not chapters_dir.exists():
+        raise FileNotFoundError(f"未找到章节目录: {chapters_dir}")
+    return sorted((d.name for d in chapters_dir.iterdir() if d.is_dir()), key=natural_sort_key)
+
+
+def resolve_chapters(novel_name: str, spec: str) -> List[str]:
+    """
+    解析章节范围，支持 "all"、"ch_3"、"3"、"1-5"、"ch_1-ch_5" 以及逗号组合（如 "1,3,5-7"）
+    """
+    all_chapters = list_chapters(novel_name)
+    if spec == "all":
+        return all_chapters
+
+    def to_index(token: str) -> int:
+        token = token.strip()
+        ch_id = token if token.startswith("ch_") else f"ch_{token}"
+        if ch_id not in all_chapters:
+            raise ValueError(f"章节不存在: {token}")
+        return all_chapters.index(ch_id)
+
+    selected = []
+    for part in spec.split(","):
+        if "-" in part:
+            start, end = (to_index(t) for t in part.split("-", 1))
+            if start > end:
+                start, end = end, start
+            selected.extend(all_chapters[start:end + 1])
+        else:
+            selected.append(all_chapters[to_index(part)])
+    return list(dict.fromkeys(selected))
+
+
+def _run_chapters(
+    novel_name: str,
+    chapters: List[str],
+    steps,
+    budget: bool = True,
+    stages: Tuple[str, ...] = (),
+    jobs: int = 1
+) -> List[str]:
+    """
+    在同一进程内处理多个章节，单章失败时记录并继续，返回失败或未处理的章节。
+    budget=True 时每章开始前检查用量预算，接近时降速、达到时停止；
+    stages 指定后按耗时模型预测各章耗时，显示剩余时间与吞吐，jobs > 1 时按预测耗时最长优先并行处理
+    """
+    from .usage_ledger import BudgetExceeded, enforce_budget
+    order, progress = list(chapters), None
+    if stages:
+        from .run_estimator import BatchProgress, format_duration, predict_chapters
+        predictions = predict_chapters(novel_name, chapters)
+        durations = {ch: sum(predictions[ch][stage] for stage in stages) for ch in chapters}
+        if jobs > 1:
+            order.sort(key=durations.get, reverse=True)
+        progress = BatchProgress(durations, {ch: predictions[ch]["chars"] for ch in chapters}, jobs)
+        parallel = f"，{jobs} 路并行（最长优先）" if jobs > 1 else ""
+        print(f"📋 {len(chapters)} 章，预计耗时 {format_duration(progress.eta())}{parallel}")
+
+    failed, finished = [], []
+    stopped = threading.Event()
+
+    def process(i: int, ch: str):
+        if stopped.is_set():
+            return
+        if budget:
+            try:
+                enforce_budget(novel_name)
+            except BudgetExceeded as e:
+                if not stopped.is_set():
+                    stopped.set()
+                    print(f"⛔ {e}，停止处理剩余章节")
+                return
+        print(f"\n===== {ch} ({i}/{len(order)}) =====")
+        start = time.monotonic()
+        try:
+            for step in steps:
+                step(novel_name, ch)
+        except Exception as e:
+            print(f"❌ {ch} 处理失败: {e}")
+            failed.append(ch)
+            return
+        finished.append(ch)
+        if progress is not None:
+            progress.finish(ch, time.monotonic() - start)
+            print(f"⏱️ {progress.summary()}")
+
+    if jobs > 1:
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            list(pool.map(process, range(1, len(order) + 1), order))
+    else:
+        for i, ch in enumerate(order, start=1):
+            process(i, ch)
+
+    skipped = [ch for ch in order if ch not in finished and ch not in failed]
+    if failed:
+        print(f"\n⚠️ {len(failed)} 个章节失败: {', '.join(failed)}")
+    if skipped:
+        print(f"⚠️ {len(skipped)} 章未处理: {', '.join(skipped)}")
+    return failed + skipped
+
+
+def cmd_init(args) -> int:
+    from .novel_init import init_novel
+    init_novel(
+        novel_file=args.novel_file,
+        chapter_pattern=args.pattern,
+        novel_name=args.name,
+        max_tokens=args.max_tokens,
+        min_tokens=args.min_tokens
+    )
+    return 0
+
+
+def cmd_script(args) -> int:
+    from .novel_parser import convert_novel_to_script
+    from .run_estimator import STAGE_LLM
+    return len(_run_chapters(
+        args.novel, resolve_chapters(args.novel, args.chapters),
+        [lambda novel, ch: convert_novel_to_script(novel, ch, use_prepass=not args.no_prepass)],
+        stages=(STAGE_LLM,), jobs=args.jobs
+    ))
+
+
+def _tts_jobs(requested: int) -> int:
+    """
+    TTS 阶段的并行数上限：未配置 tts_farm.workers 时本机每路都会各自加载一个 IndexTTS2 模型，只允许 1 路；
+    配置了 worker 时不超过 worker 数
+    """
+    if requested <= 1:
+        return requested
+    from .tts_generator import load_config
+    workers = load_config().get("tts_farm", {}).get("workers") or []
+    limit = max(len(workers), 1)
+    if requested > limit:
+        reason = f"tts_farm 只配置了 {len(workers)} 个 worker" if workers else "未配置 tts_farm，本机只能加载一个 TTS 模型"
+        print(f"⚠️ {reason}，音频生成并行数由 {requested} 调整为 {limit}")
+    return min(requested, limit)
+
+
+def cmd_characters(args) -> int:
+    from .character_manager import manage_characters
+    return len(_run_chapters(args.novel, resolve_chapters(args.novel, args.chapters), [manage_characters]))
+
+
+def cmd_voices(args) -> int:
+    from .voice_manager import sync_role_to_voice
+    sync_role_to_voice(args.novel)
+    return 0
+
+
+def cmd_tts(args) -> int:
+    from .run_estimator import STAGE_TTS
+    from .tts_generator import generate_tts_audio
+    return len(_run_chapters(
+        args.novel, resolve_chapters(args.novel, args.chapters), [generate_tts_audio],
+        budget=False, stages=(STAGE_TTS,), jobs=_tts_jobs(args.jobs)
+    ))
+
+
+def cmd_run(args) -> int:
+    from .novel_parser import convert_novel_to_script
+    from .character_manager import manage_characters
+    from .voice_manager import sync_role_to_voice
+    from .tts_generator import generate_tts_audio
+    from .run_estimator import STAGE_LLM, STAGE_TTS
+    chapters = resolve_chapters(args.novel, args.chapters)
+    script_step = lambda novel, ch: convert_novel_to_script(novel, ch, use_prepass=not args.no_prepass)
+    if args.jobs <= 1:
+        return len(_run_chapters(args.novel, chapters, [
+            script_step,
+            manage_characters,
+            lambda novel, ch: sync_role_to_voice(novel),
+            generate_tts_audio
+        ], stages=(STAGE_LLM, STAGE_TTS)))
+
+    # 并行时分阶段执行：剧本与音频按章节并行，角色库与音色会被各章共同修改，按章节顺序依次更新
+    failed = _run_chapters(args.novel, chapters, [script_step], stages=(STAGE_LLM,), jobs=args.jobs)
+    chapters = [ch for ch in chapters if ch not in failed]
+    failed += _run_chapters(args.novel, chapters, [manage_characters])
+    chapters = [ch for ch in chapters if ch not in failed]
+    if chapters:
+        sync_role_to_voice(args.novel)
+    failed += _run_chapters(
+        args.novel, chapters, [generate_tts_audio], budget=False, stages=(STAGE_TTS,), jobs=_tts_jobs(args.jobs)
+    )
+    return len(failed)
+
+
+def cmd_export(args) -> int:
+    from .book_exporter import export_audiobook
+    export_audiobook(args.novel, fmt=args.format, output_path=args.output, incremental=not args.full)
+    return 0
+
+
+def cmd_rerender(args) -> int:
+    from .line_rerender import rerender_line
+    rerender_line(args.novel, args.chapter, args.line, text=args.text, role=args.role)
+    return 0
+
+
+def cmd_aliases(args) -> int:
+    from .role_alias import load_alias_index, rebuild_alias_index, save_alias_index
+    index = load_alias_index(args.novel)
+    for item in args.set or []:
+        alias, _, target = item.partition("=")
+        if not alias or not target:
+            raise ValueError(f"格式应为 别名=角色名: {item}")
+        index["overrides"][alias] = target
+        index["aliases"].pop(alias, None)
+    for alias in args.separate or []:
+        index["overrides"][alias] = None
+        index["aliases"].pop(alias, None)
+    if args.set or args.separate:
+        save_alias_index(args.novel, index)
+    if args.rebuild:
+        index = rebuild_alias_index(args.novel)
+
+    with open(NOVELS_DIR / args.novel / "characters.json", "r", encoding="utf-8") as f:
+        names = {c.get("id"): c["role"] for c in json.load(f)}
+    for alias, char_id in sorted(index["aliases"].items()):
+        print(f"{alias}\t→ {names.get(char_id, char_id)}")
+    for alias, target in sorted(index["overrides"].items()):
+        print(f"{alias}\t→ {target if target is not None else '（独立角色）'}\t[手动]")
+    return 0
+
+
+def cmd_worker(args) -> int:
+    from .tts_worker import serve_worker
+    serve_worker(args.host, args.port, args.synth, args.cache_dir, args.stub_delay, args.worker_id)
+    return 0
+
+
+def cmd_usage(args) -> int:
+    from .usage_ledger import budget_status, summarize
+    group_by = list(dict.fromkeys(["novel", args.by]))
+    rows = summarize(group_by, args.novel, args.days)
+    if not rows:
+        print("暂无用量记录")
+    for row in rows:
+        label = " / ".join(str(row[k]) if row[k] is not None else "-" for k in group_by)
+        print(f"{label}\t调用 {row['calls']}\t输入 {row['prompt_tokens']}\t"
+              f"输出 {row['completion_tokens']}\t费用 {row['cost']:g}")
+    if args.novel:
+        for s in budget_status(args.novel):
+            print(f"预算 {s['name']}: {s['used']:g}/{s['limit']:g} ({s['ratio']:.0%})")
+    return 0
+
+
+def cmd_estimate(args) -> int:
+    from .run_estimator import (
+        STAGE_LLM, STAGE_TTS, format_duration, lpt_schedule, predict_chapters, prediction_accuracy
+    )
+    chapters = resolve_chapters(args.novel, args.chapters)
+    predictions = predict_chapters(args.novel, chapters)
+    for ch in chapters:
+        p = predictions[ch]
+        print(f"{ch}\t{p['chars']} 字\tLLM {format_duration(p[STAGE_LLM])}\tTTS {format_duration(p[STAGE_TTS])}")
+
+    durations = {ch: predictions[ch][STAGE_LLM] + predictions[ch][STAGE_TTS] for ch in chapters}
+    plan, makespan = lpt_schedule(durations, args.jobs)
+    print(f"\n按顺序单路处理: {format_duration(sum(durations.values()))}")
+    if args.jobs > 1:
+        print(f"{args.jobs} 路并行（最长优先）: {format_duration(makespan)}")
+        for i, assigned in enumerate(plan, start=1):
+            print(f"  worker {i}: {', '.join(assigned)}")
+
+    for stage, acc in prediction_accuracy().items():
+        print(f"{stage} 预测误差（最近 {acc['runs']} 次）: 平均 {acc['mape']:.0%}，实际/预测 {acc['bias']:.2f}")
+    return 0
+
+
+def cmd_status(args) -> int:
+    if not args.novel:
+        novels = sorted(d.name for d in NOVELS_DIR.iterdir() if d.is_dir())
+        if not novels:
+            print("暂无小说")
+        for novel in novels:
+            chapters_dir = NOVELS_DIR / novel / "chapters"
+            chapters = [d for d in chapters_dir.iterdir() if d.is_dir()] if chapters_dir.exists() else []
+            scripts = sum((d / "script.json").exists() for d in chapters)
+            audios = sum((d / "full_drama.wav").exists() for d in chapters)
+            print(f"{novel}\t章节 {len(chapters)}\t剧本 {scripts}\t音频 {audios}")
+        return 0
+
+    titles = load_chapter_titles(args.novel)
+    chapters_dir = NOVELS_DIR / args.novel / "chapters"
+    for ch in list_chapters(args.novel):
+        script = "✓" if (chapters_dir / ch / "script.json").exists() else "·"
+        audio = "✓" if (chapters_dir / ch / "full_drama.wav").exists() else "·"
+        print(f"{ch}\t剧本 {script}\t音频 {audio}\t{titles.get(ch, '')}")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="ainovelcast", description="AINovelCast 有声小说生成器")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("init", help="初始化小说项目结构")
+    p.add_argument("novel_file", help="小说全文文件路径（如 凡人修仙传.txt）")
+    p.add_argument("--pattern", default=DEFAULT_CHAPTER_PATTERN, help="章节分隔正则表达式")
+    p.add_argument("--name", help="小说名称（可选，默认取文件名）")
+    p.add_argument("--max_tokens", type=int, help="按 token 预算重新分块（可选，如 2500）")
+    p.add_argument("--min_tokens", type=int, help="低于该值的章节与相邻章节合并（默认 max_tokens/4）")
+    p.set_defaults(func=cmd_init)
+
+    chapter_help = '章节范围，如 "ch_3"、"1-5"、"1,3,5-7" 或 "all"'
+    for name, func, help_text in [
+        ("script", cmd_script, "将章节 raw.txt 转换为剧本 script.json"),
+        ("characters", cmd_characters, "根据剧本更新角色性格库"),
+        ("tts", cmd_tts, "根据剧本生成章节音频"),
+        ("run", cmd_run, "完整流程：剧本 → 角色 → 音色 → 音频"),
+    ]:
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("--novel", required=True, help="小说名称")
+        p.add_argument("--chapters", default="all", help=chapter_help)
+        if name in ("script", "run"):
+            p.add_argument("--no_prepass", action="store_true", help="不做规则预处理，整章交给 LLM")
+        if name in ("script", "tts", "run"):
+            p.add_argument("--jobs", type=int, default=1, help="并行处理的章节数，按预测耗时最长优先分配")
+        p.set_defaults(func=func)
+
+    p = sub.add_parser("voices", help="为缺少音色的角色生成音色")
+    p.add_argument("--novel", required=True, help="小说名称")
+    p.set_defaults(func=cmd_voices)
+
+    p = sub.add_parser("status", help="查看小说及章节处理进度")
+    p.add_argument("--novel", help="小说名称（不指定则列出所有小说）")
+    p.set_defaults(func=cmd_status)
+
+    p = sub.add_parser("usage", help="查看大模型 token 与音色设计调用的用量及预算")
+    p.add_argument("--novel", help="小说名称（可选）")
+    p.add_argument("--days", type=int, help="只统计最近 N 天")
+    p.add_argument("--by", default="stage", choices=["novel", "stage", "chapter", "model", "day"], help="汇总维度")
+    p.set_defaults(func=cmd_usage)
+
+    p = sub.add_parser("estimate", help="按历史运行数据预测各章耗时与批量处理的总耗时")
+    p.add_argument("--novel", required=True, help="小说名称")
+    p.add_argument("--chapters", default="all", help=chapter_help)
+    p.add_argument("--jobs", type=int, default=1, help="并行数")
+    p.set_defaults(func=cmd_estimate)
+
+    p = sub.add_parser("export", help="将整本小说导出为带章节标记的有声书")
+    p.add_argument("--novel", required=True, help="小说名称")
+    p.add_argument("--format", default="m4b", choices=["m4b", "mka", "flac", "wav"])
+    p.add_argument("--output", help="输出路径（默认 data/novels/{novel}/export/{novel}.{format}）")
+    p.add_argument("--full", action="store_true", help="忽略缓存，重新编码全部章节")
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser("rerender", help="重新合成单行并替换到整章音频中（不调用大模型）")
+    p.add_argument("--novel", required=True, help="小说名称")
+    p.add_argument("--chapter", required=True, help="章节，如 ch_3")
+    p.add_argument("--line", type=int, required=True, help="行号（从 0 开始，与 segments/segment_XXX.wav 一致）")
+    p.add_argument("--text", help="修改后的台词（可选）")
+    p.add_argument("--role", help="改用的角色音色（可选）")
+    p.set_defaults(func=cmd_rerender)
+
+    p = sub.add_parser("aliases", help="查看或维护角色别名索引")
+    p.add_argument("--novel", required=True, help="小说名称")
+    p.add_argument("--rebuild", action="store_true", help="扫描全部章节与历史剧本重建别名索引")
+    p.add_argument("--set", action="append", metavar="别名=角色名", help="手动指定别名归属（可多次）")
+    p.add_argument("--separate", action="append", metavar="别名", help="标记该称呼为独立角色，不做合并（可多次）")
+    p.set_defaults(func=cmd_aliases)
+
+    from .tts_worker import add_worker_arguments
+    p = sub.add_parser("worker", help="启动 TTS 工作节点，供 tts_farm 协调端分发任务")
+    add_worker_arguments(p)
+    p.set_defaults(func=cmd_worker)
+
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    try:
+        return 1 if args.func(args) else 0
+    except (FileNotFoundError, ValueError, RuntimeError) as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
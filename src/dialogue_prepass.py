@@ -0,0 +1,174 @@
+import json
+import re
+from typing import Dict, List, Optional, Tuple
+from . import NOVELS_DIR
+from .role_alias import SPEECH_VERBS, attribution_pattern
+
+QUOTE_PAIRS = {"“": "”", "「": "」", "『": "』"}
+SPEECH_VERB_PATTERN = re.compile(f"(?:{SPEECH_VERBS})(?=[：:，,。\\s]|$)")
+# 作者感言、求票等内容交给 LLM 按规则过滤
+AUTHOR_NOTE_PATTERN = re.compile(r"求(?:月票|推荐|收藏|订阅)|月票|推荐票|打赏|作者|[Pp][Ss][:：]|更新")
+PUNCT_ONLY_PATTERN = re.compile(r"^[\s，。！？；：、…—,.!?;:\"'”」』]*$")
+# 说话归属与相邻引号之间只允许的字符，如“韩立道：”中的冒号、“”韩立道，“”中的逗号
+ATTRIBUTION_EDGE_PATTERN = re.compile(r"^[\s，,：:。.]*$")
+
+
+def load_name_map(novel_name: str) -> Dict[str, str]:
+    """角色名及其别名 -> 规范角色名（不含旁白）"""
+    novel_dir = NOVELS_DIR / novel_name
+    name_map = {}
+    characters_path = novel_dir / "characters.json"
+    if characters_path.exists():
+        with open(characters_path, "r", encoding="utf-8") as f:
+            characters = json.load(f)
+        ids = {c.get("id"): c["role"] for c in characters}
+        name_map.update({c["role"]: c["role"] for c in characters if c["role"] != "旁白"})
+        aliases_path = novel_dir / "aliases.json"
+        if aliases_path.exists():
+            with open(aliases_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            for alias, char_id in index.get("aliases", {}).items():
+                if ids.get(char_id) not in (None, "旁白"):
+                    name_map.setdefault(alias, ids[char_id])
+    return name_map
+
+
+def split_quotes(paragraph: str) -> Optional[List[Tuple[str, str]]]:
+    """
+    将段落切分为 [("narration", 文本), ("quote", 引号内文本), ...]；引号不配对时返回 None
+    """
+    parts, buf, i = [], "", 0
+    while i < len(paragraph):
+        ch = paragraph[i]
+        if ch in QUOTE_PAIRS:
+            end = paragraph.find(QUOTE_PAIRS[ch], i + 1)
+            if end == -1:
+                return None
+            if buf:
+                parts.append(("narration", buf))
+                buf = ""
+            parts.append(("quote", paragraph[i + 1:end]))
+            i = end + 1
+            continue
+        if ch in QUOTE_PAIRS.values():
+            return None
+        buf += ch
+        i += 1
+    if buf:
+        parts.append(("narration", buf))
+    return parts
+
+
+def _attributed_speakers(narration: str, name_map: Dict[str, str]) -> Optional[set]:
+    """
+    找出叙述中“名字 + 短状语 + 说话动词”形式的归属，名字须位于分句开头。
+    若存在无法归属到已知角色的说话动词，或名字与动词之间还夹着另一个角色名，返回 None
+    """
+    verbs = len(SPEECH_VERB_PATTERN.findall(narration))
+    speakers, matched = set(), 0
+    for name in sorted(name_map, key=len, reverse=True):
+        for m in attribution_pattern(name).finditer(narration):
+            filler = m.group(0)[len(name):]
+            if any(other in filler for other in name_map if other != name):
+                return None
+            speakers.add(name_map[name])
+            matched += 1
+            narration = narration[:m.start()] + "\0" * (m.end() - m.start()) + narration[m.end():]
+    if matched != verbs:
+        return None
+    return speakers
+
+
+def _attribution_edges(narration: str, name_map: Dict[str, str]) -> Tuple[bool, bool]:
+    """返回 (叙述以说话归属开头, 叙述以说话归属结尾)，用于判断引号是否紧挨着归属"""
+    starts = ends = False
+    for name in name_map:
+        for m in attribution_pattern(name).finditer(narration):
+            starts = starts or ATTRIBUTION_EDGE_PATTERN.match(narration[:m.start()]) is not None
+            ends = ends or ATTRIBUTION_EDGE_PATTERN.match(narration[m.end():]) is not None
+    return starts, ends
+
+
+def _quotes_attached(parts: List[Tuple[str, str]], name_map: Dict[str, str]) -> bool:
+    """
+    每段引号都须紧挨着说话归属：“X道：“…””“…”X道。”或标准的“…”X道，“…”拆分形式。
+    两段引号之间没有叙述（如“韩立道：“走吧。”“等等我！””）时通常已经换了说话人，返回 False
+    """
+    parts = [(kind, text) for kind, text in parts if kind == "quote" or not PUNCT_ONLY_PATTERN.match(text)]
+    edges = [_attribution_edges(text, name_map) if kind == "narration" else None for kind, text in parts]
+    for k, (kind, _) in enumerate(parts):
+        if kind != "quote":
+            continue
+        prev = parts[k - 1][0] if k > 0 else None
+        nxt = parts[k + 1][0] if k + 1 < len(parts) else None
+        if "quote" in (prev, nxt):
+            return False
+        if not ((prev == "narration" and edges[k - 1][1]) or (nxt == "narration" and edges[k + 1][0])):
+            return False
+    return True
+
+
+def prepass_paragraph(paragraph: str, name_map: Dict[str, str]) -> Optional[List[Dict]]:
+    """
+    对单段做规则解析：无引号的叙述直接作为旁白；引号内台词能唯一归属到已知角色，
+    且每段引号都紧挨着说话归属时拆分为旁白 + 台词。无法确定时返回 None，交给 LLM
+    """
+    if AUTHOR_NOTE_PATTERN.search(paragraph):
+        return None
+    parts = split_quotes(paragraph)
+    if parts is None:
+        return None
+    if all(kind == "narration" for kind, _ in parts):
+        return [{"role": "旁白", "text": paragraph}]
+
+    narration = "".join(text if kind == "narration" else "“”" for kind, text in parts)
+    speakers = _attributed_speakers(narration, name_map)
+    if not speakers or len(speakers) != 1:
+        return None
+    if not _quotes_attached(parts, name_map):
+        return None
+    speaker = next(iter(speakers))
+
+    lines = []
+    for kind, text in parts:
+        text = text.strip()
+        if kind == "narration":
+            text = text.strip("，,")
+            if PUNCT_ONLY_PATTERN.match(text):
+                continue
+            lines.append({"role": "旁白", "text": text})
+        elif text:
+            lines.append({"role": speaker, "text": text})
+    return lines
+
+
+def prepass_chapter(paragraphs: List[str], name_map: Dict[str, str]) -> List[Optional[List[Dict]]]:
+    """逐段解析，返回与 paragraphs 等长的列表，None 表示该段需要 LLM 处理"""
+    return [prepass_paragraph(p, name_map) for p in paragraphs]
+
+
+def build_segmented_text(paragraphs: List[str], results: List[Optional[List[Dict]]]) -> Tuple[str, List[List[int]]]:
+    """
+    将连续的待处理段落合并为“【待转换 N】”片段，并在前后各附一段“【上下文】”，
+    返回 (供 LLM 使用的文本, 每个片段包含的段落下标)
+    """
+    blocks: List[List[int]] = []
+    for i, res in enumerate(results):
+        if res is None:
+            if blocks and blocks[-1][-1] == i - 1:
+                blocks[-1].append(i)
+            else:
+                blocks.append([i])
+
+    chunks = []
+    last_context = None
+    for n, block in enumerate(blocks, start=1):
+        before, after = block[0] - 1, block[-1] + 1
+        if before >= 0 and results[before] is not None and before != last_context:
+            chunks.append(f"【上下文】{paragraphs[before]}")
+        chunks.append(f"【待转换 {n}】")
+        chunks.extend(paragraphs[i] for i in block)
+        if after < len(paragraphs) and results[after] is not None:
+            chunks.append(f"【上下文】{paragraphs[after]}")
+            last_context = after
+    return "\n".join(chunks), blocks
@@ -0,0 +1,257 @@
+"""
+情感向量预计算：在合成前对一章的全部台词分批推理情感向量，缓存到 script.json 旁的 emotions.json，
+合成时以 emo_vector 显式传给 IndexTTS2，避免每行都在合成循环中单独运行一次文本情感模型（use_emo_text）。
+
+script.json 中的某一行可用 "emotion" 字段手动指定情感，优先于模型结果，例如：
+    {"role": "韩立", "text": "……", "emotion": {"angry": 0.8, "calm": 0.2}}
+    {"role": "韩立", "text": "……", "emotion": [0, 0.8, 0, 0, 0, 0, 0, 0.2]}
+"""
+import hashlib
+import json
+import os
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+from . import CONFIG_DIR, NOVELS_DIR
+
+# 与 IndexTTS2 emo_vector 的维度顺序一致
+EMOTION_KEYS = ["happy", "angry", "sad", "afraid", "disgusted", "melancholic", "surprised", "calm"]
+EMOTION_KEYS_CN = {
+    "高兴": "happy", "愤怒": "angry", "悲伤": "sad", "恐惧": "afraid",
+    "反感": "disgusted", "低落": "melancholic", "惊讶": "surprised", "自然": "calm"
+}
+
+# 默认参数，可在 config.json 的 "emotion" 字段中覆盖
+DEFAULT_EMOTION_CONFIG = {
+    "precompute": True,   # 关闭后回退为逐行 use_emo_text
+    "batch_size": 16
+}
+
+
+def load_emotion_config() -> dict:
+    cfg = dict(DEFAULT_EMOTION_CONFIG)
+    if CONFIG_DIR.exists():
+        with open(CONFIG_DIR, "r", encoding="utf-8") as f:
+            cfg.update(json.load(f).get("emotion", {}))
+    return cfg
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.strip().encode("utf-8")).hexdigest()[:16]
+
+
+def parse_emotion_override(value) -> List[float]:
+    """将手动指定的情感（按维度顺序的列表，或 英文/中文情感名 -> 权重 的字典）转为 8 维向量"""
+    if isinstance(value, dict):
+        vector = [0.0] * len(EMOTION_KEYS)
+        for key, weight in value.items():
+            key = EMOTION_KEYS_CN.get(key, key)
+            if key not in EMOTION_KEYS:
+                raise ValueError(f"未知的情感类别: {key}")
+            vector[EMOTION_KEYS.index(key)] = float(weight)
+        return vector
+    if isinstance(value, list) and len(value) == len(EMOTION_KEYS):
+        return [float(v) for v in value]
+    raise ValueError(f"无法解析的情感设置: {value}")
+
+
+class StubEmotionModel:
+    """
+    桩情感模型：按文本哈希生成确定的向量，并模拟模型加载、每次前向与每条文本的耗时，
+    用于在没有 GPU 的环境下测量分批推理相对逐行推理的节省
+    """
+
+    name = "stub"
+
+    def __init__(self, load_delay: float = 0.0, call_delay: float = 0.0, item_delay: float = 0.0):
+        self.load_delay = load_delay
+        self.call_delay = call_delay
+        self.item_delay = item_delay
+
+    def infer_batches(self, texts: List[str], batch_size: int) -> List[List[float]]:
+        time.sleep(self.load_delay)
+        vectors = []
+        for i in range(0, len(texts), batch_size):
+            batch = texts[i:i + batch_size]
+            time.sleep(self.call_delay + self.item_delay * len(batch))
+            for text in batch:
+                digest = hashlib.sha256(text.encode("utf-8")).digest()
+                raw = [b / 255 for b in digest[:len(EMOTION_KEYS)]]
+                total = sum(raw) or 1.0
+                vectors.append([round(v / total, 4) for v in raw])
+        return vectors
+
+
+class IndexTTSEmotionModel:
+    """在 INDEXTTS_PATH 的环境中以子进程方式加载 IndexTTS2 的文本情感模型（QwenEmotion），分批推理"""
+
+    name = "qwen_emo"
+
+    BATCH_SCRIPT = '''
+import json, os, re, sys
+sys.path.insert(0, ".")
+from omegaconf import OmegaConf
+from indextts.infer_v2 import QwenEmotion
+
+KEYS = {keys!r}
+
+with open(r"{task_path}", "r", encoding="utf-8") as f:
+    task = json.load(f)
+
+cfg = OmegaConf.load("checkpoints/config.yaml")
+qwen = QwenEmotion(os.path.join("checkpoints", cfg.qwen_emo_path))
+tok, model = qwen.tokenizer, qwen.model
+tok.padding_side = "left"
+
+def parse(text, content):
+    # 与 QwenEmotion.inference 的后处理一致
+    try:
+        content = json.loads(content)
+    except json.JSONDecodeError:
+        content = {{m.group(1): float(m.group(2)) for m in re.finditer(r'([^\\s":.,]+?)"?\\s*:\\s*([\\d.]+)', content)}}
+    if any(word in text.lower() for word in qwen.melancholic_words):
+        content["悲伤"], content["低落"] = content.get("低落", 0.0), content.get("悲伤", 0.0)
+    return qwen.convert(content)
+
+results = []
+texts = task["texts"]
+for i in range(0, len(texts), task["batch_size"]):
+    batch = texts[i:i + task["batch_size"]]
+    prompts = [
+        tok.apply_chat_template(
+            [{{"role": "system", "content": qwen.prompt}}, {{"role": "user", "content": t}}],
+            tokenize=False, add_generation_prompt=True, enable_thinking=False
+        )
+        for t in batch
+    ]
+    inputs = tok(prompts, return_tensors="pt", padding=True).to(model.device)
+    generated = model.generate(**inputs, max_new_tokens=256, pad_token_id=tok.eos_token_id)
+    for text, ids in zip(batch, generated[:, inputs.input_ids.shape[1]:].tolist()):
+        try:
+            start = len(ids) - ids[::-1].index(151668)  # 跳过 </think>
+        except ValueError:
+            start = 0
+        emo = parse(text, tok.decode(ids[start:], skip_special_tokens=True))
+        results.append([float(emo[k]) for k in KEYS])
+    print(f"情感向量 {{len(results)}}/{{len(texts)}}", flush=True)
+
+with open(r"{result_path}", "w", encoding="utf-8") as f:
+    json.dump(results, f)
+'''
+
+    def __init__(self, indextts_path: Optional[str] = None):
+        self.b_dir = Path(indextts_path or os.environ.get("INDEXTTS_PATH", "/root/index-tts"))
+
+    def infer_batches(self, texts: List[str], batch_size: int) -> List[List[float]]:
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False, dir=self.b_dir, encoding='utf-8') as tmpf:
+            json.dump({"texts": texts, "batch_size": batch_size}, tmpf, ensure_ascii=False)
+            task_path = Path(tmpf.name)
+        result_path = task_path.with_suffix(".out.json")
+        script = self.BATCH_SCRIPT.format(keys=EMOTION_KEYS, task_path=task_path, result_path=result_path)
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False, dir=self.b_dir, encoding='utf-8') as tmpf:
+            tmpf.write(script)
+            script_path = Path(tmpf.name)
+        try:
+            subprocess.run(["uv", "run", script_path.name], cwd=self.b_dir, check=True)
+            with open(result_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        finally:
+            for p in (task_path, result_path, script_path):
+                p.unlink(missing_ok=True)
+
+
+def emotions_path(novel_name: str, chapter_id: str) -> Path:
+    return NOVELS_DIR / novel_name / "chapters" / chapter_id / "emotions.json"
+
+
+def load_emotion_cache(novel_name: str, chapter_id: str, model_name: str) -> Dict[str, List[float]]:
+    """读取 emotions.json；缓存由其他模型生成时视为无效"""
+    path = emotions_path(novel_name, chapter_id)
+    if not path.exists():
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        cache = json.load(f)
+    return cache.get("vectors", {}) if cache.get("model") == model_name else {}
+
+
+def precompute_emotions(
+    novel_name: str,
+    chapter_id: str,
+    model=None,
+    batch_size: Optional[int] = None
+) -> List[List[float]]:
+    """
+    为 script.json 的每一行返回情感向量：手动指定的优先，其余按文本哈希查缓存，
+    缓存中没有的去重后分批推理并写回 emotions.json
+    """
+    script_path = NOVELS_DIR / novel_name / "chapters" / chapter_id / "script.json"
+    if not script_path.exists():
+        raise FileNotFoundError(f"剧本不存在: {script_path}")
+    with open(script_path, "r", encoding="utf-8") as f:
+        lines = json.load(f)["lines"]
+
+    model = model or IndexTTSEmotionModel()
+    batch_size = batch_size or load_emotion_config()["batch_size"]
+    vectors = load_emotion_cache(novel_name, chapter_id, model.name)
+
+    missing = {}
+    for line in lines:
+        if "emotion" not in line and text_hash(line["text"]) not in vectors:
+            missing.setdefault(text_hash(line["text"]), line["text"])
+
+    if missing:
+        start = time.perf_counter()
+        print(f"🎭 推理情感向量: {len(missing)} 条文本，每批 {batch_size} 条")
+        results = model.infer_batches(list(missing.values()), batch_size)
+        vectors.update(zip(missing.keys(), results))
+        elapsed = time.perf_counter() - start
+        print(f"✅ 情感向量完成，耗时 {elapsed:.2f}s（{elapsed / len(missing) * 1000:.1f} ms/行）")
+
+    # 只保留当前剧本用到的条目，剧本修改后旧文本的向量随之清理
+    used = {text_hash(line["text"]) for line in lines if "emotion" not in line}
+    with open(emotions_path(novel_name, chapter_id), "w", encoding="utf-8") as f:
+        json.dump({"model": model.name, "vectors": {h: v for h, v in vectors.items() if h in used}},
+                  f, ensure_ascii=False, indent=2)
+
+    return [
+        parse_emotion_override(line["emotion"]) if "emotion" in line else vectors[text_hash(line["text"])]
+        for line in lines
+    ]
+
+
+def benchmark_batching(texts: List[str], batch_size: int, model) -> Dict[str, float]:
+    """分别以逐行与分批方式推理同一组文本，返回两者的每行耗时（毫秒）"""
+    timings = {}
+    for label, size in (("per_line", 1), ("batched", batch_size)):
+        start = time.perf_counter()
+        if size == 1:
+            # 模拟 use_emo_text：合成循环中每行单独调用一次情感模型
+            for text in texts:
+                model.infer_batches([text], 1)
+        else:
+            model.infer_batches(texts, size)
+        timings[label] = (time.perf_counter() - start) / max(len(texts), 1) * 1000
+    return timings
+
+
+# ====== CLI 入口 ======
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="预计算章节台词的情感向量")
+    parser.add_argument("--novel", required=True)
+    parser.add_argument("--chapter", required=True)
+    parser.add_argument("--batch_size", type=int)
+    parser.add_argument("--stub", action="store_true", help="使用桩模型（测试用）")
+    parser.add_argument("--benchmark", action="store_true", help="用桩模型比较逐行与分批推理的每行耗时")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        with open(NOVELS_DIR / args.novel / "chapters" / args.chapter / "script.json", "r", encoding="utf-8") as f:
+            texts = [line["text"] for line in json.load(f)["lines"]]
+        stub = StubEmotionModel(call_delay=0.02, item_delay=0.002)
+        timings = benchmark_batching(texts, args.batch_size or load_emotion_config()["batch_size"], stub)
+        print(f"逐行: {timings['per_line']:.1f} ms/行，分批: {timings['batched']:.1f} ms/行")
+    else:
+        precompute_emotions(args.novel, args.chapter, StubEmotionModel() if args.stub else None, args.batch_size)
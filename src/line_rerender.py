@@ -0,0 +1,146 @@
+import json
+import os
+from pathlib import Path
+from typing import Dict, Optional
+from . import NOVELS_DIR
+from .audio_postprocess import (
+    SEGMENT_INDEX_NAME,
+    _to_pcm16,
+    assemble_chapter,
+    compute_gap_ms,
+    load_postprocess_config,
+    load_segment_index,
+    process_segment,
+    save_segment_index,
+    splice_frames
+)
+from .tts_generator import attach_emotion_vectors, build_tts_line, resolve_line_roles, synthesize_lines
+
+
+def rerender_line(
+    novel_name: str,
+    chapter_id: str,
+    line_index: int,
+    text: Optional[str] = None,
+    role: Optional[str] = None
+) -> Dict:
+    """
+    重新合成剧本中的某一行（可修改台词或角色），并替换 full_drama.wav 中对应的区间。
+    新音频与原区间等长时原位覆盖，否则只平移其后的数据；其他片段不重新处理，也不调用大模型
+    """
+    INDEXTTS_PATH = os.environ.get("INDEXTTS_PATH", "/root/index-tts")
+    B_DIR = Path(INDEXTTS_PATH)
+
+    NOVEL_DIR = NOVELS_DIR / novel_name
+    CHAPTER_DIR = NOVEL_DIR / "chapters" / chapter_id
+    SEGMENTS_DIR = CHAPTER_DIR / "segments"
+    SCRIPT_PATH = CHAPTER_DIR / "script.json"
+    ROLE_MAP_PATH = NOVEL_DIR / "role_to_voice.json"
+    FINAL_PATH = CHAPTER_DIR / "full_drama.wav"
+    INDEX_PATH = CHAPTER_DIR / SEGMENT_INDEX_NAME
+
+    for p, name in [(SCRIPT_PATH, "剧本"), (ROLE_MAP_PATH, "角色音色映射"), (FINAL_PATH, "章节音频")]:
+        if not p.exists():
+            raise FileNotFoundError(f"{name}不存在: {p}")
+
+    with open(SCRIPT_PATH, "r", encoding="utf-8") as f:
+        script_data = json.load(f)
+    with open(ROLE_MAP_PATH, "r", encoding="utf-8") as f:
+        role_map = json.load(f)
+    lines = script_data["lines"]
+    if not 0 <= line_index < len(lines):
+        raise ValueError(f"行号超出范围: {line_index}（共 {len(lines)} 行）")
+
+    cfg = load_postprocess_config()
+    if not INDEX_PATH.exists():
+        # 旧版本生成的章节没有偏移索引：用现有片段重新拼接一次（不重新合成）
+        print("⚠️ 未找到片段偏移索引，使用现有片段重新拼接以建立索引")
+        segment_paths = [SEGMENTS_DIR / f"segment_{i:03d}.wav" for i in range(len(lines))]
+        save_segment_index(INDEX_PATH, assemble_chapter(
+            segment_paths, resolve_line_roles(novel_name, lines, role_map), FINAL_PATH, cfg
+        ))
+    index = load_segment_index(INDEX_PATH)
+    if len(index["segments"]) != len(lines):
+        raise ValueError("片段索引与剧本行数不一致，请重新生成本章音频")
+
+    original_script = json.loads(json.dumps(script_data))
+    if text is not None:
+        if not text.strip():
+            raise ValueError("台词不能为空")
+        lines[line_index]["text"] = text.strip()
+    if role is not None:
+        lines[line_index]["role"] = role
+    edited = script_data != original_script
+    if edited:
+        with open(SCRIPT_PATH, "w", encoding="utf-8") as f:
+            json.dump(script_data, f, ensure_ascii=False, indent=2)
+
+    # 先合成到临时文件，成功后再替换原片段
+    resolved_lines = resolve_line_roles(novel_name, lines, role_map)
+    segment_path = SEGMENTS_DIR / f"segment_{line_index:03d}.wav"
+    new_segment_path = SEGMENTS_DIR / f"segment_{line_index:03d}.new.wav"
+    try:
+        task_line = build_tts_line(line_index, resolved_lines[line_index], role_map, B_DIR, SEGMENTS_DIR)
+        task_line["output_wav"] = str(new_segment_path)
+        attach_emotion_vectors(novel_name, chapter_id, [task_line])
+        print(f"🔁 重新合成第 {line_index} 行: [{resolved_lines[line_index]['role']}] {resolved_lines[line_index]['text']}")
+        synthesize_lines([task_line], B_DIR)
+        samples, sr = process_segment(new_segment_path, cfg)
+        if sr != index["sample_rate"] or samples.shape[1] != index["channels"]:
+            raise ValueError(f"新片段格式 ({sr} Hz, {samples.shape[1]} 声道) 与整章音频不一致")
+    except Exception:
+        # 失败时恢复原剧本，保证 script.json 与 full_drama.wav 一致
+        if edited:
+            with open(SCRIPT_PATH, "w", encoding="utf-8") as f:
+                json.dump(original_script, f, ensure_ascii=False, indent=2)
+        new_segment_path.unlink(missing_ok=True)
+        raise
+
+    def gap_frames(i: int) -> int:
+        next_line = resolved_lines[i + 1] if i + 1 < len(resolved_lines) else None
+        return int(sr * compute_gap_ms(resolved_lines[i], next_line, cfg) / 1000)
+
+    channels = index["channels"]
+    segments = index["segments"]
+    seg = segments[line_index]
+    new_gap = gap_frames(line_index)
+    region_start, region_end = seg["start"], seg["end"] + seg["gap"]
+    pcm = _to_pcm16(samples) + b"\x00\x00" * channels * new_gap
+    # 换角色可能改变上一行之后的停顿，一并替换
+    prev_gap = gap_frames(line_index - 1) if line_index > 0 else None
+    if prev_gap is not None and prev_gap != segments[line_index - 1]["gap"]:
+        region_start = segments[line_index - 1]["end"]
+        pcm = b"\x00\x00" * channels * prev_gap + pcm
+
+    delta = splice_frames(FINAL_PATH, region_start, region_end, pcm)
+    new_segment_path.replace(segment_path)
+
+    if region_start != seg["start"]:
+        segments[line_index - 1]["gap"] = prev_gap
+        seg["start"] = region_start + prev_gap
+    seg["end"] = seg["start"] + len(samples)
+    seg["gap"] = new_gap
+    for later in segments[line_index + 1:]:
+        later["start"] += delta
+        later["end"] += delta
+    index["total_frames"] += delta
+    save_segment_index(INDEX_PATH, index)
+
+    if delta == 0:
+        print(f"✅ 第 {line_index} 行已原位替换")
+    else:
+        print(f"✅ 第 {line_index} 行已替换，其后音频平移 {delta / sr:+.2f}s")
+    return {"line": line_index, "in_place": delta == 0, "delta_frames": delta, "start": seg["start"], "end": seg["end"]}
+
+
+# ====== CLI 入口 ======
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="重新合成章节中的单行并替换整章音频中的对应区间")
+    parser.add_argument("--novel", required=True)
+    parser.add_argument("--chapter", required=True)
+    parser.add_argument("--line", type=int, required=True, help="行号（从 0 开始，与 segments/segment_XXX.wav 一致）")
+    parser.add_argument("--text", help="修改后的台词（可选）")
+    parser.add_argument("--role", help="改用的角色音色（可选）")
+    args = parser.parse_args()
+    rerender_line(args.novel, args.chapter, args.line, args.text, args.role)
@@ -1,11 +1,16 @@
 # novel_init.py
 import re
 import json
+import shutil
+import time
 from pathlib import Path
 from charset_normalizer import from_path
-from typing import List, Optional
+from typing import Dict, List, Optional
 from . import NOVELS_DIR,VOICE_DIR
 
+CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]")
+SENTENCE_SPLIT_PATTERN = re.compile(r"(?<=[。！？!?…」”])")
+
 def read_text_robustly(file_path: Path) -> str:
     """
     使用 charset-normalizer 自动检测编码并读取文本，
@@ -16,10 +21,144 @@ def read_text_robustly(file_path: Path) -> str:
         raise RuntimeError(f"无法检测文件编码: {file_path}")
     return str(result)
 
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算 token 数：中日文字符及全角标点约 1 token/字，其余非空白字符约 4 字符/token
+    """
+    cjk = len(CJK_PATTERN.findall(text))
+    other = len(re.sub(r"\s", "", text)) - cjk
+    return cjk + (other + 3) // 4
+
+def _split_long_paragraph(paragraph: str, max_tokens: int) -> List[str]:
+    """单段超出预算时按句末标点切分，仍超出的句子按长度硬切"""
+    pieces, current = [], ""
+    for sentence in SENTENCE_SPLIT_PATTERN.split(paragraph):
+        if not sentence:
+            continue
+        if current and estimate_tokens(current + sentence) > max_tokens:
+            pieces.append(current)
+            current = ""
+        while estimate_tokens(sentence) > max_tokens:
+            pieces.append(sentence[:max_tokens])
+            sentence = sentence[max_tokens:]
+        current += sentence
+    if current:
+        pieces.append(current)
+    return pieces
+
+def _split_chapter(ch_lines: List[str], max_tokens: int, lead: Optional[List[str]] = None) -> List[List[str]]:
+    """
+    按段落边界将超长章节均衡地切成若干份，每份不超过 max_tokens。
+    标题行（以及需要并入的前一个过短单元 lead）与第一段绑定在一起切分，避免它们单独成为一份
+    """
+    title = "\n".join((lead or []) + [ch_lines[0]])
+    body = ch_lines[1:]
+    title_tokens = estimate_tokens(title)
+    paragraphs = []
+    for k, line in enumerate(body):
+        budget = max(max_tokens - title_tokens, 1) if k == 0 else max_tokens
+        if estimate_tokens(line) > budget:
+            paragraphs.extend(_split_long_paragraph(line, budget))
+        else:
+            paragraphs.append(line)
+    if paragraphs:
+        paragraphs[0] = f"{title}\n{paragraphs[0]}"
+    else:
+        paragraphs = [title]
+    sizes = [estimate_tokens(p) for p in paragraphs]
+    n_parts = -(-sum(sizes) // max_tokens)
+    target = sum(sizes) / n_parts
+
+    parts, current, current_tokens = [], [], 0
+    for paragraph, size in zip(paragraphs, sizes):
+        if current and (current_tokens + size > max_tokens or current_tokens >= target):
+            parts.append(current)
+            current, current_tokens = [], 0
+        current.append(paragraph)
+        current_tokens += size
+    if current:
+        parts.append(current)
+    return parts
+
+def rechunk_chapters(
+    chapters: List[List[str]],
+    max_tokens: int,
+    min_tokens: Optional[int] = None
+) -> List[Dict]:
+    """
+    将按标题切分的章节重新整理为大小均衡的处理单元：
+    超过 max_tokens 的章节按段落拆分，低于 min_tokens 的章节与相邻的单元（包括拆分后的首尾部分）合并，
+    合并后不超过 max_tokens。
+
+    返回处理单元列表，每项包含 lines、source_chapters（原章节序号，从 1 开始）、part、parts，
+    以及 split_chapter（被拆分的原章节序号，没有则为 None）
+    """
+    if min_tokens is None:
+        min_tokens = max_tokens // 4
+
+    units: List[Dict] = []
+    for ch_no, ch_lines in enumerate(chapters, start=1):
+        tokens = estimate_tokens("\n".join(ch_lines))
+        last = units[-1] if units else None
+        if tokens > max_tokens:
+            # 前一个过短的单元并入拆分后的第一部分
+            lead = None
+            if last is not None and last["split_chapter"] is None and last["tokens"] < min_tokens:
+                lead = units.pop()
+            parts = _split_chapter(ch_lines, max_tokens, lead["lines"] if lead else None)
+            split_units = [
+                {
+                    "lines": part_lines,
+                    "source_chapters": (lead["source_chapters"] if lead and part_no == 1 else []) + [ch_no],
+                    "part": part_no,
+                    "parts": len(parts),
+                    "split_chapter": ch_no,
+                    "tokens": estimate_tokens("\n".join(part_lines))
+                }
+                for part_no, part_lines in enumerate(parts, start=1)
+            ]
+            units.extend(split_units)
+            continue
+
+        # 过短的章节并入前一个单元（可以是拆分后的最后一部分），或前一个单元过短时把本章并入
+        if (
+            last is not None
+            and (last["tokens"] < min_tokens or tokens < min_tokens)
+            and last["tokens"] + tokens <= max_tokens
+        ):
+            last["lines"].extend(ch_lines)
+            last["source_chapters"].append(ch_no)
+            last["tokens"] += tokens
+        else:
+            units.append({
+                "lines": list(ch_lines),
+                "source_chapters": [ch_no],
+                "part": 1,
+                "parts": 1,
+                "split_chapter": None,
+                "tokens": tokens
+            })
+    return units
+
+def _archive_chapter_dirs(novel_dir: Path, chapter_dirs: List[Path]) -> Optional[Path]:
+    """
+    将内容已失效的章节目录（连同其中的剧本、音频、片段索引等）整体移到 archive/chapters_{时间}/ 下，
+    避免批量处理、status 与导出读到与 raw.txt 不一致的旧结果
+    """
+    if not chapter_dirs:
+        return None
+    archive_dir = novel_dir / "archive" / time.strftime("chapters_%Y%m%d_%H%M%S")
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    for ch_dir in chapter_dirs:
+        shutil.move(str(ch_dir), str(archive_dir / ch_dir.name))
+    return archive_dir
+
 def init_novel(
     novel_file: str,
     chapter_pattern: str = r"^[ \t\u3000]*(?:第)?[零一二三四五六七八九十百千\d]{1,10}[章话节]",
-    novel_name: Optional[str] = None
+    novel_name: Optional[str] = None,
+    max_tokens: Optional[int] = None,
+    min_tokens: Optional[int] = None
 ):
     """
     初始化小说项目结构
@@ -28,6 +167,8 @@ def init_novel(
         novel_file: 小说全文文件路径（如 "凡人修仙传.txt"）
         chapter_pattern: 用于分割章节的正则表达式
         novel_name: 小说名（若未提供，则用文件名去掉后缀）
+        max_tokens: 若提供，则按 token 预算重新分块：超长章节按段落拆分，过短章节合并
+        min_tokens: 低于该值的章节会与相邻章节合并（默认 max_tokens 的四分之一）
     """
     novel_path = Path(novel_file).resolve()
     if not novel_path.exists():
@@ -72,14 +213,61 @@ def init_novel(
         # 若无匹配，整本书作为第一章（保留所有非空行）
         chapters = [[line.strip() for line in lines if line.strip()]]
 
+    # === 按 token 预算重新分块（可选）===
+    if max_tokens:
+        units = rechunk_chapters(chapters, max_tokens, min_tokens)
+    else:
+        units = [
+            {"lines": ch_lines, "source_chapters": [i], "part": 1, "parts": 1, "split_chapter": None}
+            for i, ch_lines in enumerate(chapters, start=1)
+        ]
+
+    # === 重新导入时归档失效的章节目录 ===
+    # 分块方式改变后，多出来的 ch_{K+1}.. 与 raw.txt 内容变化的 ch_i 中的剧本和音频都已不再对应
+    stale = []
+    for ch_dir in chapters_dir.iterdir():
+        match = re.fullmatch(r"ch_(\d+)", ch_dir.name)
+        if not ch_dir.is_dir() or not match:
+            continue
+        n = int(match.group(1))
+        raw_path = ch_dir / "raw.txt"
+        if n > len(units) or not raw_path.exists() or \
+                raw_path.read_text(encoding="utf-8") != "\n".join(units[n - 1]["lines"]):
+            stale.append(ch_dir)
+    stale.sort(key=lambda d: int(d.name[3:]))
+    archive_dir = _archive_chapter_dirs(novel_dir, stale)
+    if archive_dir is not None:
+        print(f"🗄️ 已将 {len(stale)} 个内容变化或多余的章节目录移到 {archive_dir}: {[d.name for d in stale]}")
+
     # === 写入各章节 raw.txt ===
-    for i, ch_lines in enumerate(chapters, start=1):  # 注意：不再解包 (title, lines)
+    manifest = []
+    for i, unit in enumerate(units, start=1):
+        text = "\n".join(unit["lines"])
         ch_dir = chapters_dir / f"ch_{i}"
         ch_dir.mkdir(exist_ok=True)
-        (ch_dir / "raw.txt").write_text("\n".join(ch_lines), encoding="utf-8")
-        print(f"📄 章节 {i}: {len(ch_lines)} 行")
+        (ch_dir / "raw.txt").write_text(text, encoding="utf-8")
+        print(f"📄 章节 {i}: {len(text.splitlines())} 行")
 
-    print(f"✅ 共创建 {len(chapters)} 个章节")
+        # 记录处理单元与原章节标题的对应关系，供导出时命名
+        title = " / ".join(
+            chapters[n - 1][0] + (f"（{unit['part']}/{unit['parts']}）" if n == unit["split_chapter"] else "")
+            for n in unit["source_chapters"]
+        )
+        manifest.append({
+            "chapter_id": f"ch_{i}",
+            "title": title,
+            "source_chapters": unit["source_chapters"],
+            "part": unit["part"],
+            "parts": unit["parts"]
+        })
+
+    with open(novel_dir / "chapters.json", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    if max_tokens:
+        print(f"✅ 共 {len(chapters)} 个原章节，按 {max_tokens} token 预算整理为 {len(units)} 个处理单元")
+    else:
+        print(f"✅ 共创建 {len(chapters)} 个章节")
 
     # === 初始化 characters.json（默认含旁白）===
     characters_path = novel_dir / "characters.json"
@@ -123,10 +311,14 @@ if __name__ == "__main__":
     parser.add_argument("--pattern", default=r"^[ \t\u3000]*(?:第)?[零一二三四五六七八九十百千\d]{1,10}[章话节]", 
                         help='章节分隔正则表达式（默认匹配 "第一章"、"100话" 等）')
     parser.add_argument("--name", help="小说名称（可选，默认取文件名）")
+    parser.add_argument("--max_tokens", type=int, help="按 token 预算重新分块（可选，如 2500）")
+    parser.add_argument("--min_tokens", type=int, help="低于该值的章节与相邻章节合并（默认 max_tokens/4）")
     args = parser.parse_args()
 
     init_novel(
         novel_file=args.novel_file,
         chapter_pattern=args.pattern,
-        novel_name=args.name
+        novel_name=args.name,
+        max_tokens=args.max_tokens,
+        min_tokens=args.min_tokens
     )
\ No newline at end of file
@@ -1,33 +1,31 @@
 import json
 import re
+import time
+from collections import defaultdict
 from pathlib import Path
 from openai import OpenAI
 from . import CONFIG_DIR, NOVELS_DIR
+from .dialogue_prepass import build_segmented_text, load_name_map, prepass_chapter
+from .novel_init import estimate_tokens
+from .run_estimator import STAGE_LLM, record_run
+from .usage_ledger import STAGE_SCRIPT, check_budget, record_completion
+
+SEGMENT_RULE = """
+【分段处理规则】
+9. 原文已被划分为若干“【待转换 N】”片段，只转换这些片段中的内容；“【上下文】”开头的段落仅用于判断说话人，不得输出。
+10. 每个输出对象需额外包含字段 "seg"，其值为该条目所属片段的编号 N（整数），所有条目按原文顺序输出（下方示例省略了该字段）。
+"""
+
+# 每个剧本条目除正文外的 JSON 结构开销（估算值）
+LINE_OVERHEAD_TOKENS = 10
 
 def load_config():
     with open(CONFIG_DIR, "r", encoding="utf-8") as f:
         return json.load(f)
 
-def convert_novel_to_script(novel_name: str, chapter_id: str):
-    """
-    将 novels/{novel}/chapters/{chapter}/raw.txt 转换为 script.json
-    """
-    RAW_TXT_PATH = NOVELS_DIR / novel_name / "chapters" / chapter_id / "raw.txt"
-    SCRIPT_JSON_PATH = NOVELS_DIR / novel_name / "chapters" / chapter_id / "script.json"
-
-    if not RAW_TXT_PATH.exists():
-        raise FileNotFoundError(f"未找到原始小说文本: {RAW_TXT_PATH}")
-
-    with open(RAW_TXT_PATH, "r", encoding="utf-8") as f:
-        raw_text = f.read().strip()
-    if not raw_text:
-        raise ValueError(f"{RAW_TXT_PATH} 内容为空")
-
-    # 加载 LLM 配置
-    config = load_config()
-    llm_cfg = config["llm"]["novel_to_script"]
-    client = OpenAI(api_key=llm_cfg["api_key"], base_url=llm_cfg["base_url"])
-
+def build_script_prompt(raw_text: str, segmented: bool = False) -> str:
+    """构造剧本改编提示词；segmented=True 时原文为带“【待转换 N】”标记的片段"""
+    segment_rule = SEGMENT_RULE if segmented else ""
     json_example = """
 {
       "lines": [
@@ -66,7 +64,7 @@ def convert_novel_to_script(novel_name: str, chapter_id: str):
     ]
 }
 """
-    PROMPT = f"""你是一位专业的有声书剧本改编师。请将以下小说片段转换为结构化的有声书剧本，严格遵循以下规则：
+    return f"""你是一位专业的有声书剧本改编师。请将以下小说片段转换为结构化的有声书剧本，严格遵循以下规则：
 
 1. 输出必须是纯 JSON 格式，仅包含一个顶层对象，其字段为 "lines"，值为对象列表。
 2. 每个对象包含两个字段："role"（角色名）和 "text"（该角色说出的完整台词或旁白叙述的完整语句）。
@@ -93,7 +91,7 @@ def convert_novel_to_script(novel_name: str, chapter_id: str):
 
 【内容过滤规则】
 8. 若原文包含与正篇叙事无关的内容（如作者感言、章节备注、致谢、互动留言、广告等，通常出现在章末或独立段落），请完全忽略，不予处理。
-
+{segment_rule}
 请直接输出符合上述规则的 JSON，不要包含任何解释、注释或额外文本。
 
 【One-Shot 示例参考】
@@ -107,13 +105,23 @@ def convert_novel_to_script(novel_name: str, chapter_id: str):
 
 小说原文：
 {raw_text}
-""" 
+"""
+
+def request_script_lines(prompt: str, novel_name: str, chapter_id: str) -> list:
+    """调用 LLM 并解析、校验返回的剧本条目"""
+    # 加载 LLM 配置
+    config = load_config()
+    llm_cfg = config["llm"]["novel_to_script"]
+    client = OpenAI(api_key=llm_cfg["api_key"], base_url=llm_cfg["base_url"])
+
+    check_budget(novel_name)
     print("🧠 正在调用 LLM 转换小说为剧本...")
     completion = client.chat.completions.create(
         model=llm_cfg["model"],
-        messages=[{"role": "user", "content": PROMPT}],
+        messages=[{"role": "user", "content": prompt}],
         max_tokens=4096
     )
+    record_completion(novel_name, chapter_id, STAGE_SCRIPT, llm_cfg["model"], completion)
     response_text = completion.choices[0].message.content
 
     # 解析 JSON
@@ -137,11 +145,91 @@ def convert_novel_to_script(novel_name: str, chapter_id: str):
         if not (isinstance(item, dict) and "role" in item and "text" in item):
             raise ValueError(f"第 {i+1} 行格式错误")
 
+    return result["lines"]
+
+def merge_segmented_lines(results: list, blocks: list, llm_lines: list) -> list:
+    """按原文顺序合并规则解析结果与 LLM 返回的各片段条目"""
+    by_seg = defaultdict(list)
+    for item in llm_lines:
+        seg = item.pop("seg", None)
+        try:
+            seg = int(seg)
+        except (TypeError, ValueError):
+            raise ValueError(f"LLM 返回的条目缺少有效的 seg 字段: {item}")
+        if not 1 <= seg <= len(blocks):
+            raise ValueError(f"LLM 返回了不存在的片段编号: {seg}")
+        by_seg[seg].append(item)
+
+    block_starts = {block[0]: n for n, block in enumerate(blocks, start=1)}
+    lines = []
+    for i, res in enumerate(results):
+        if res is not None:
+            lines.extend(res)
+        elif i in block_starts:
+            lines.extend(by_seg[block_starts[i]])
+    return lines
+
+def convert_novel_to_script(novel_name: str, chapter_id: str, use_prepass: bool = True):
+    """
+    将 novels/{novel}/chapters/{chapter}/raw.txt 转换为 script.json
+
+    use_prepass=True 时先用规则解析：无引号的叙述段和能明确归属到已知角色的对话段直接生成条目，
+    只有剩余段落（附带前后文）交给 LLM，统计写入同目录的 prepass.json
+    """
+    RAW_TXT_PATH = NOVELS_DIR / novel_name / "chapters" / chapter_id / "raw.txt"
+    SCRIPT_JSON_PATH = NOVELS_DIR / novel_name / "chapters" / chapter_id / "script.json"
+
+    if not RAW_TXT_PATH.exists():
+        raise FileNotFoundError(f"未找到原始小说文本: {RAW_TXT_PATH}")
+
+    with open(RAW_TXT_PATH, "r", encoding="utf-8") as f:
+        raw_text = f.read().strip()
+    if not raw_text:
+        raise ValueError(f"{RAW_TXT_PATH} 内容为空")
+
+    start = time.perf_counter()
+    paragraphs = [line.strip() for line in raw_text.splitlines() if line.strip()]
+    if use_prepass:
+        results = prepass_chapter(paragraphs, load_name_map(novel_name))
+    else:
+        results = [None] * len(paragraphs)
+
+    if all(res is None for res in results):
+        lines = request_script_lines(build_script_prompt(raw_text), novel_name, chapter_id)
+    elif any(res is None for res in results):
+        segmented_text, blocks = build_segmented_text(paragraphs, results)
+        lines = merge_segmented_lines(
+            results, blocks, request_script_lines(build_script_prompt(segmented_text, segmented=True), novel_name, chapter_id)
+        )
+    else:
+        print("⚡ 全部段落已由规则解析，跳过 LLM")
+        lines = [line for res in results for line in res]
+    result = {"lines": lines}
+
+    if use_prepass:
+        rule_lines = [line for res in results if res is not None for line in res]
+        rule_text = "\n".join(p for p, res in zip(paragraphs, results) if res is not None)
+        tokens_saved = 2 * estimate_tokens(rule_text) + LINE_OVERHEAD_TOKENS * len(rule_lines)
+        if all(res is not None for res in results):
+            tokens_saved += estimate_tokens(build_script_prompt(""))
+        stats = {
+            "paragraphs": len(paragraphs),
+            "rule_paragraphs": sum(res is not None for res in results),
+            "skipped_char_ratio": round(len(rule_text) / max(len("\n".join(paragraphs)), 1), 4),
+            "tokens_saved": tokens_saved,
+            "llm_called": any(res is None for res in results)
+        }
+        with open(SCRIPT_JSON_PATH.parent / "prepass.json", "w", encoding="utf-8") as f:
+            json.dump(stats, f, ensure_ascii=False, indent=2)
+        print(f"⚡ 规则预处理: {stats['rule_paragraphs']}/{stats['paragraphs']} 段、"
+              f"{stats['skipped_char_ratio']:.0%} 的文本跳过 LLM，约节省 {tokens_saved} tokens")
+
     # 保存
     with open(SCRIPT_JSON_PATH, "w", encoding="utf-8") as f:
         json.dump(result, f, ensure_ascii=False, indent=2)
 
     print(f"✅ 剧本已保存至: {SCRIPT_JSON_PATH}")
+    record_run(novel_name, chapter_id, STAGE_LLM, time.perf_counter() - start)
     return str(SCRIPT_JSON_PATH)
 
 
@@ -151,5 +239,6 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="将小说 raw.txt 转换为剧本 script.json")
     parser.add_argument("--novel", required=True)
     parser.add_argument("--chapter", required=True)
+    parser.add_argument("--no_prepass", action="store_true", help="不做规则预处理，整章交给 LLM")
     args = parser.parse_args()
-    convert_novel_to_script(args.novel, args.chapter)
\ No newline at end of file
+    convert_novel_to_script(args.novel, args.chapter, use_prepass=not args.no_prepass)
\ No newline at end of file
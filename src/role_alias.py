@@ -0,0 +1,244 @@
+import json
+import re
+from collections import Counter
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional, Tuple
+from . import NOVELS_DIR
+
+# 复姓，其余按首字取姓
+COMPOUND_SURNAMES = {
+    "欧阳", "南宫", "上官", "司马", "诸葛", "慕容", "令狐", "东方", "皇甫", "独孤", "公孙", "长孙",
+    "宇文", "司徒", "夏侯", "轩辕", "端木", "西门", "百里", "呼延", "尉迟", "澹台", "太史", "申屠"
+}
+# “姓 + 称谓”形式的常见称呼，如“韩兄”“韩师弟”“南宫道友”。
+# 不含“夫人/姑娘/老爷/公子”等多用于称呼同姓家人或女性的称谓，以免把“韩夫人”“韩姑娘”并入“韩立”
+HONORIFICS = (
+    "兄", "弟", "师兄", "师弟", "师姐", "师妹", "师叔", "师伯", "师祖", "道友", "前辈", "大哥", "二哥",
+    "兄弟", "老弟", "老哥", "先生", "长老", "掌门", "道长", "真人", "老祖", "老怪", "老魔", "小子",
+    "老头", "大人"
+)
+# 包含全名的称呼中出现这些字词时，说的是与该角色有关系的另一个人，如“韩立之父”“韩立的母亲”“韩立弟子”
+RELATION_WORDS = (
+    "之", "的", "父", "母", "爹", "娘", "妻", "夫", "儿", "女", "孙", "侄", "弟子", "徒", "家", "侍", "仆",
+    "手下", "师父", "师傅", "师尊"
+)
+# 只有以下规则得到的匹配写入 aliases.json；包含全名、姓+称谓与模糊匹配只在当次解析中使用
+PERSISTENT_RULES = {"exact", "override", "alias", "hint"}
+# 文本中的共指线索，如“韩立，人称韩跑跑”“厉飞雨又名……”
+COREF_PATTERN = re.compile(
+    r"(?P<name>[\u4e00-\u9fff]{2,4})[，,]?(?:人称|外号|绰号|号称|又称|又名|自称)[“「\"『]?(?P<alias>[\u4e00-\u9fff]{2,4})"
+)
+SPEECH_VERBS = "说道|问道|笑道|喝道|叫道|答道|喊道|骂道|叹道|怒道|冷笑道|沉声道|低声道|开口道|道|说|问"
+SPEECH_VERB_PATTERN = re.compile(r"(?:说道|问道|笑道|喝道|叫道|答道|道|说)[：:]\s*$")
+# 说话人与说话动词之间只允许很短的状语，如“淡淡”“笑着”“冷哼一声”，避免把其间的另一个主语误认作说话人
+ATTRIBUTION_FILLER = r"(?:[^，。！？；：“”「」『』的,.!?;:\s]{0,2}|[^，。！？；：“”「」『』的,.!?;:\s]{0,3}(?:地|着|一声))"
+CLAUSE_START = "，。！？；：”」』…—,.!?;: \t　"
+
+FUZZY_THRESHOLD = 0.8
+MIN_HINT_VOTES = 2
+
+
+def alias_index_path(novel_name: str):
+    return NOVELS_DIR / novel_name / "aliases.json"
+
+
+def load_alias_index(novel_name: str) -> Dict:
+    """
+    读取 aliases.json：
+      aliases:   已确认的别名 -> 角色 id
+      overrides: 手动指定的别名 -> 角色名/角色 id；值为 null 表示该称呼是独立角色，不做合并
+      hints:     从原文与剧本中收集的共指线索 别名 -> {角色名: 次数}，由 chapter_hints 汇总而来
+      chapter_hints: 各章节贡献的共指线索 章节 -> {别名: {角色名: 次数}}，重复处理同一章时整体替换
+    """
+    path = alias_index_path(novel_name)
+    index = {"aliases": {}, "overrides": {}, "hints": {}, "chapter_hints": {}}
+    if path.exists():
+        with open(path, "r", encoding="utf-8") as f:
+            index.update(json.load(f))
+    return index
+
+
+def save_alias_index(novel_name: str, index: Dict):
+    with open(alias_index_path(novel_name), "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+
+
+def surname_of(name: str) -> str:
+    return name[:2] if name[:2] in COMPOUND_SURNAMES else name[:1]
+
+
+def _find_by(characters: List[Dict], key: str, value) -> Optional[Dict]:
+    for char in characters:
+        if char.get(key) == value:
+            return char
+    return None
+
+
+def _is_subsequence(short: str, long: str) -> bool:
+    chars = iter(long)
+    return all(ch in chars for ch in short)
+
+
+def attribution_pattern(name: str) -> re.Pattern:
+    """“名字 + 短状语 + 说话动词”，名字须位于分句开头"""
+    return re.compile(
+        f"(?:^|(?<=[{re.escape(CLAUSE_START)}])){re.escape(name)}{ATTRIBUTION_FILLER}?(?:{SPEECH_VERBS})(?=[：:，,。\\s]|$)"
+    )
+
+
+def _unique(candidates: List[Dict]) -> Optional[Dict]:
+    unique = {id(c): c for c in candidates}
+    return next(iter(unique.values())) if len(unique) == 1 else None
+
+
+def _is_personal_name(role: str) -> bool:
+    """姓 + 一到两字的名（如“韩立”“厉飞雨”“南宫婉”），“黑衣老者”之类的描述性称呼不算"""
+    return 1 <= len(role) - len(surname_of(role)) <= 2
+
+
+def resolve_role(name: str, characters: List[Dict], index: Dict) -> Optional[Dict]:
+    """将剧本中的角色称呼解析为角色库中的规范角色，无法唯一确定时返回 None"""
+    return match_role(name, characters, index)[0]
+
+
+def match_role(name: str, characters: List[Dict], index: Dict) -> Tuple[Optional[Dict], Optional[str]]:
+    """
+    与 resolve_role 相同，同时返回命中的规则名，调用方据此决定是否写入 aliases.json（见 PERSISTENT_RULES）。
+    依次尝试：精确匹配 exact → 手动指定 override → 已确认别名 alias → 共指线索 hint →
+    包含全名 contains → 姓+称谓 surname → 模糊匹配 fuzzy
+    """
+    exact = _find_by(characters, "role", name)
+    if exact is not None:
+        return exact, "exact"
+
+    if name in index["overrides"]:
+        target = index["overrides"][name]
+        if target is None:
+            return None, None
+        char = _find_by(characters, "id" if isinstance(target, int) else "role", target)
+        return char, "override" if char is not None else None
+
+    if name in index["aliases"]:
+        char = _find_by(characters, "id", index["aliases"][name])
+        if char is not None:
+            return char, "alias"
+
+    named = [c for c in characters if c.get("role") and c["role"] != "旁白"]
+
+    # 线索至少累计 MIN_HINT_VOTES 票才据此判断
+    votes = index["hints"].get(name)
+    if votes:
+        char = _unique([c for c in named if votes.get(c["role"], 0) >= MIN_HINT_VOTES])
+        if char is not None:
+            return char, "hint"
+
+    # 称呼中包含完整名字，如“韩立师兄”“师兄韩立”；“韩立之父”“韩立的母亲”等说的是另一个人
+    char = _unique([
+        c for c in named
+        if len(c["role"]) >= 2 and c["role"] in name
+        and not any(word in name.replace(c["role"], "", 1) for word in RELATION_WORDS)
+    ])
+    if char is not None:
+        return char, "contains"
+
+    # 姓 + 称谓，如“韩兄”“南宫道友”；同姓角色不止一个时不做判断
+    for suffix in sorted(HONORIFICS, key=len, reverse=True):
+        if name.endswith(suffix) and len(name) > len(suffix):
+            prefix = name[:-len(suffix)]
+            char = _unique([c for c in named if _is_personal_name(c["role"]) and surname_of(c["role"]) == prefix])
+            if char is not None:
+                return char, "surname"
+            break
+
+    # 模糊匹配只接受“多了几个字”的称呼（如“黑衣老者”与“黑衣老者甲”），
+    # 替换了字的（如“灰衣老者”与“黑衣老者”）视为不同角色
+    if len(name) >= 3:
+        best = [
+            c for c in named
+            if len(c["role"]) >= 3
+            and (_is_subsequence(c["role"], name) or _is_subsequence(name, c["role"]))
+            and SequenceMatcher(None, name, c["role"]).ratio() >= FUZZY_THRESHOLD
+        ]
+        char = _unique(best)
+        if char is not None:
+            return char, "fuzzy"
+    return None, None
+
+
+def collect_hints(raw_text: str, script_lines: List[Dict], known_roles: List[str]) -> Dict[str, Counter]:
+    """
+    从原文的“人称/外号/又名”等句式，以及剧本中“X说道：”后紧跟的台词角色收集共指线索
+    """
+    hints: Dict[str, Counter] = {}
+    known = set(known_roles)
+
+    for match in COREF_PATTERN.finditer(raw_text):
+        name, alias = match.group("name"), match.group("alias")
+        if name != alias:
+            hints.setdefault(alias, Counter())[name] += 1
+
+    # 只有已知角色作为分句主语紧挨着说话动词时（如“韩立淡淡道：”）才算线索；
+    # “银月看着韩立，笑道：”中的韩立是被说话的对象，不计入
+    patterns = {r: attribution_pattern(r) for r in known if r != "旁白"}
+    for prev, line in zip(script_lines, script_lines[1:]):
+        role = line["role"]
+        if prev["role"] != "旁白" or role == "旁白" or role in known:
+            continue
+        if not SPEECH_VERB_PATTERN.search(prev["text"]):
+            continue
+        mentioned = [r for r, pattern in patterns.items() if pattern.search(prev["text"])]
+        if len(mentioned) == 1:
+            hints.setdefault(role, Counter())[mentioned[0]] += 1
+    return hints
+
+
+def set_chapter_hints(index: Dict, chapter_id: str, hints: Dict[str, Counter]):
+    """替换某一章贡献的线索并重新汇总，重复处理同一章不会重复计票"""
+    index["chapter_hints"][chapter_id] = {alias: dict(votes) for alias, votes in hints.items()}
+    merged: Dict[str, Counter] = {}
+    for chapter in index["chapter_hints"].values():
+        for alias, votes in chapter.items():
+            merged.setdefault(alias, Counter()).update(votes)
+    index["hints"] = {alias: dict(votes) for alias, votes in merged.items()}
+
+
+def update_hints_from_chapter(novel_name: str, chapter_id: str, index: Dict, known_roles: List[str]):
+    """读取一章的 raw.txt 与 script.json，更新该章的共指线索"""
+    ch_dir = NOVELS_DIR / novel_name / "chapters" / chapter_id
+    raw_text = (ch_dir / "raw.txt").read_text(encoding="utf-8") if (ch_dir / "raw.txt").exists() else ""
+    script_lines = []
+    if (ch_dir / "script.json").exists():
+        with open(ch_dir / "script.json", "r", encoding="utf-8") as f:
+            script_lines = json.load(f)["lines"]
+    set_chapter_hints(index, chapter_id, collect_hints(raw_text, script_lines, known_roles))
+
+
+def rebuild_alias_index(novel_name: str) -> Dict:
+    """
+    扫描全部章节重新收集共指线索，并将历史剧本中出现过的称呼解析为规范角色后写入 aliases.json
+    （只写入 PERSISTENT_RULES 规则得到的匹配）
+    """
+    novel_dir = NOVELS_DIR / novel_name
+    with open(novel_dir / "characters.json", "r", encoding="utf-8") as f:
+        characters = json.load(f)
+    known_roles = [c["role"] for c in characters]
+
+    index = load_alias_index(novel_name)
+    index["aliases"], index["hints"], index["chapter_hints"] = {}, {}, {}
+    surface_names = set()
+    chapters_dir = novel_dir / "chapters"
+    chapter_dirs = [d for d in chapters_dir.iterdir() if d.is_dir()] if chapters_dir.exists() else []
+    for ch_dir in chapter_dirs:
+        update_hints_from_chapter(novel_name, ch_dir.name, index, known_roles)
+        if (ch_dir / "script.json").exists():
+            with open(ch_dir / "script.json", "r", encoding="utf-8") as f:
+                surface_names.update(line["role"] for line in json.load(f)["lines"])
+
+    for name in sorted(surface_names - set(known_roles)):
+        char, rule = match_role(name, characters, index)
+        if char is not None and char.get("id") is not None and rule in PERSISTENT_RULES:
+            index["aliases"][name] = char["id"]
+
+    save_alias_index(novel_name, index)
+    return index
+
@@ -0,0 +1,245 @@
+"""
+章节耗时模型：根据历史运行记录，用章节字数、对话字数、角色数和音色数预测每章的 LLM（剧本转换）与 TTS 耗时，
+用于批量处理时按“最长优先”分配章节、估算剩余时间，并在每次运行后对比预测与实际耗时。
+运行记录保存在 data/runs.db（SQLite）。
+"""
+import heapq
+import json
+import re
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from statistics import median
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from . import DATA_DIR, NOVELS_DIR
+
+RUNS_PATH = DATA_DIR / "runs.db"
+
+STAGE_LLM = "llm"
+STAGE_TTS = "tts"
+
+# 各阶段的回归特征；剧本转换时尚无 script.json，角色数与音色数只用于 TTS
+FEATURES = {
+    STAGE_LLM: ["chars", "dialogue_chars"],
+    STAGE_TTS: ["chars", "dialogue_chars", "roles", "voices"]
+}
+# 历史记录不足时使用的默认速率（秒/字）与每千字角色数、音色数
+DEFAULT_RATES = {STAGE_LLM: 0.01, STAGE_TTS: 0.25}
+DEFAULT_PER_KCHAR = {"roles": 2.0, "voices": 1.5}
+HISTORY_LIMIT = 500
+
+QUOTE_PATTERN = re.compile(r"“[^”]*”|「[^」]*」|『[^』]*』")
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(round(max(seconds, 0)))
+    h, rem = divmod(seconds, 3600)
+    m, s = divmod(rem, 60)
+    return f"{h}:{m:02d}:{s:02d}" if h else f"{m:02d}:{s:02d}"
+
+
+def chapter_features(novel_name: str, chapter_id: str, role_map: Optional[Dict] = None) -> Dict:
+    """
+    读取章节特征：chars（不含空白的字数）、dialogue_chars（引号内字数），
+    有 script.json 时还包括 roles（不同角色数）与 voices（不同参考音色数），否则为 None
+    """
+    ch_dir = NOVELS_DIR / novel_name / "chapters" / chapter_id
+    raw_path = ch_dir / "raw.txt"
+    text = re.sub(r"\s", "", raw_path.read_text(encoding="utf-8")) if raw_path.exists() else ""
+    features = {
+        "chars": len(text),
+        "dialogue_chars": sum(len(m) - 2 for m in QUOTE_PATTERN.findall(text)),
+        "roles": None,
+        "voices": None
+    }
+    script_path = ch_dir / "script.json"
+    if script_path.exists():
+        if role_map is None:
+            role_map_path = NOVELS_DIR / novel_name / "role_to_voice.json"
+            role_map = {}
+            if role_map_path.exists():
+                with open(role_map_path, "r", encoding="utf-8") as f:
+                    role_map = json.load(f)
+        with open(script_path, "r", encoding="utf-8") as f:
+            roles = {line["role"] for line in json.load(f)["lines"]}
+        features["roles"] = len(roles)
+        features["voices"] = len({role_map.get(role, role) for role in roles})
+    return features
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(RUNS_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts REAL NOT NULL,
+            novel TEXT NOT NULL,
+            chapter TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            chars INTEGER NOT NULL,
+            dialogue_chars INTEGER NOT NULL,
+            roles INTEGER,
+            voices INTEGER,
+            seconds REAL NOT NULL,
+            predicted REAL
+        );
+        CREATE INDEX IF NOT EXISTS idx_runs_stage ON runs (stage, ts);
+    """)
+    return conn
+
+
+class CostModel:
+    """
+    每个阶段一个带少量岭正则的线性模型：耗时 ≈ b0 + b1·字数 + b2·对话字数 (+ b3·角色数 + b4·音色数)。
+    样本不足以拟合时退化为按字数的中位速率
+    """
+
+    def __init__(self, history: Dict[str, List[Dict]]):
+        self.coef: Dict[str, np.ndarray] = {}
+        self.scale: Dict[str, np.ndarray] = {}
+        self.rate: Dict[str, float] = {}
+        self.samples: Dict[str, int] = {}
+        rows_with_script = [r for rows in history.values() for r in rows if r.get("roles") is not None and r["chars"]]
+        self.per_kchar = {
+            key: median(r[key] / r["chars"] * 1000 for r in rows_with_script) if rows_with_script else default
+            for key, default in DEFAULT_PER_KCHAR.items()
+        }
+        for stage in FEATURES:
+            self._fit(stage, [r for r in history.get(stage, []) if r["chars"] > 0])
+
+    @classmethod
+    def load(cls, limit: int = HISTORY_LIMIT) -> "CostModel":
+        """用 runs.db 中各阶段最近 limit 条记录拟合"""
+        history = {}
+        with closing(_connect()) as conn:
+            for stage in FEATURES:
+                rows = conn.execute(
+                    "SELECT * FROM runs WHERE stage = ? ORDER BY ts DESC LIMIT ?", (stage, limit)
+                ).fetchall()
+                history[stage] = [dict(r) for r in rows]
+        return cls(history)
+
+    def _design(self, stage: str, features: Dict) -> List[float]:
+        filled = dict(features)
+        for key in ("roles", "voices"):
+            if filled.get(key) is None:
+                filled[key] = filled["chars"] / 1000 * self.per_kchar[key]
+        return [1.0] + [float(filled[key]) for key in FEATURES[stage]]
+
+    def _fit(self, stage: str, rows: List[Dict]):
+        self.samples[stage] = len(rows)
+        self.rate[stage] = median(r["seconds"] / r["chars"] for r in rows) if rows else DEFAULT_RATES[stage]
+        if len(rows) < len(FEATURES[stage]) + 3:
+            return
+        X = np.array([self._design(stage, r) for r in rows])
+        y = np.array([r["seconds"] for r in rows])
+        scale = np.maximum(np.abs(X).max(axis=0), 1e-9)
+        Xs = X / scale
+        ridge = 1e-3 * len(rows) * np.eye(Xs.shape[1])
+        ridge[0, 0] = 0.0  # 不惩罚截距
+        self.coef[stage] = np.linalg.solve(Xs.T @ Xs + ridge, Xs.T @ y)
+        self.scale[stage] = scale
+
+    def predict(self, stage: str, features: Dict) -> float:
+        if stage in self.coef:
+            pred = float(np.array(self._design(stage, features)) / self.scale[stage] @ self.coef[stage])
+            if pred > 0:
+                return pred
+        return self.rate[stage] * features["chars"]
+
+
+def predict_chapters(novel_name: str, chapters: List[str], model: Optional[CostModel] = None) -> Dict[str, Dict]:
+    """返回 {章节: {"chars", "llm", "tts"}}，耗时以秒计"""
+    model = model or CostModel.load()
+    role_map_path = NOVELS_DIR / novel_name / "role_to_voice.json"
+    role_map = {}
+    if role_map_path.exists():
+        with open(role_map_path, "r", encoding="utf-8") as f:
+            role_map = json.load(f)
+    predictions = {}
+    for ch in chapters:
+        features = chapter_features(novel_name, ch, role_map)
+        predictions[ch] = {"chars": features["chars"], **{stage: model.predict(stage, features) for stage in FEATURES}}
+    return predictions
+
+
+def lpt_schedule(durations: Dict[str, float], workers: int) -> Tuple[List[List[str]], float]:
+    """最长处理时间优先（LPT）：按预测耗时从长到短，依次分给当前负载最小的 worker。返回 (各 worker 的章节, 总耗时)"""
+    workers = max(1, workers)
+    plan = [[] for _ in range(workers)]
+    loads = [(0.0, i) for i in range(workers)]
+    for ch, seconds in sorted(durations.items(), key=lambda kv: kv[1], reverse=True):
+        load, i = heapq.heappop(loads)
+        plan[i].append(ch)
+        heapq.heappush(loads, (load + seconds, i))
+    return plan, max(load for load, _ in loads)
+
+
+def record_run(novel_name: str, chapter_id: str, stage: str, seconds: float) -> float:
+    """记录一次实际耗时，并与（不含本次记录的）模型预测对比，返回预测值"""
+    features = chapter_features(novel_name, chapter_id)
+    predicted = CostModel.load().predict(stage, features)
+    with closing(_connect()) as conn, conn:
+        conn.execute(
+            "INSERT INTO runs (ts, novel, chapter, stage, chars, dialogue_chars, roles, voices, seconds, predicted)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (time.time(), novel_name, chapter_id, stage, features["chars"], features["dialogue_chars"],
+             features["roles"], features["voices"], seconds, predicted)
+        )
+    if predicted > 0:
+        print(f"⏱️ {stage} 实际耗时 {format_duration(seconds)}，预测 {format_duration(predicted)}"
+              f"（偏差 {(seconds - predicted) / predicted:+.0%}）")
+    return predicted
+
+
+def prediction_accuracy(limit: int = 50) -> Dict[str, Dict]:
+    """各阶段最近 limit 次运行的平均绝对百分比误差（mape）与整体偏差（实际总耗时 / 预测总耗时）"""
+    accuracy = {}
+    with closing(_connect()) as conn:
+        for stage in FEATURES:
+            rows = conn.execute(
+                "SELECT seconds, predicted FROM runs WHERE stage = ? AND predicted > 0 AND seconds > 0"
+                " ORDER BY ts DESC LIMIT ?", (stage, limit)
+            ).fetchall()
+            if rows:
+                accuracy[stage] = {
+                    "runs": len(rows),
+                    "mape": sum(abs(r["seconds"] - r["predicted"]) / r["seconds"] for r in rows) / len(rows),
+                    "bias": sum(r["seconds"] for r in rows) / sum(r["predicted"] for r in rows)
+                }
+    return accuracy
+
+
+class BatchProgress:
+    """批量处理的进度、吞吐与剩余时间；剩余时间按已完成章节的实际/预测比例校正"""
+
+    def __init__(self, predicted: Dict[str, float], chars: Dict[str, int], jobs: int = 1):
+        self.predicted = predicted
+        self.chars = chars
+        self.jobs = max(1, jobs)
+        self.done: Dict[str, float] = {}
+        self.start = time.monotonic()
+        self.lock = threading.Lock()
+
+    def finish(self, chapter_id: str, seconds: float):
+        with self.lock:
+            self.done[chapter_id] = seconds
+
+    def calibration(self) -> float:
+        predicted_done = sum(self.predicted[ch] for ch in self.done)
+        return sum(self.done.values()) / predicted_done if predicted_done > 0 else 1.0
+
+    def eta(self) -> float:
+        remaining = {ch: p for ch, p in self.predicted.items() if ch not in self.done}
+        return lpt_schedule(remaining, self.jobs)[1] * self.calibration() if remaining else 0.0
+
+    def summary(self) -> str:
+        with self.lock:
+            elapsed = time.monotonic() - self.start
+            done_chars = sum(self.chars.get(ch, 0) for ch in self.done)
+            throughput = done_chars / elapsed * 60 if elapsed > 0 else 0.0
+            return (f"{len(self.done)}/{len(self.predicted)} 章完成，已用 {format_duration(elapsed)}，"
+                    f"吞吐 {throughput:.0f} 字/分钟，预计剩余 {format_duration(self.eta())}")
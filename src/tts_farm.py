@@ -0,0 +1,227 @@
+import hashlib
+import time
+import uuid
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import Dict, List
+import requests
+
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class TTSFarmCoordinator:
+    """
+    将一章的合成任务按批次分发给多个 TTS worker（见 tts_worker.py）：
+
+    - 参考音频按内容哈希上传，每个 worker 只上传一次；
+    - 每个批次以租约形式归属某个 worker，轮询任务进度即为心跳并续租；
+    - worker 超过租期无响应、任务丢失或失败时，未取回的行重新排队交给其他 worker；
+    - 已完成的片段边合成边取回，写入各行的 output_wav。
+    """
+
+    def __init__(
+        self,
+        workers: List[str],
+        batch_size: int = 8,
+        lease_seconds: float = 60.0,
+        poll_interval: float = 0.5,
+        heartbeat_interval: float = 5.0,
+        max_attempts: int = 3,
+        request_timeout: float = 10.0
+    ):
+        if not workers:
+            raise ValueError("未配置任何 TTS worker")
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.max_attempts = max_attempts
+        self.request_timeout = request_timeout
+        self.session = requests.Session()
+        now = time.monotonic()
+        self.workers = [
+            {"url": url.rstrip("/"), "alive": True, "job": None, "last_ok": now, "next_probe": now, "refs": set()}
+            for url in workers
+        ]
+        self.ref_hashes: Dict[str, str] = {}
+
+    def synthesize(self, lines: List[Dict]):
+        """
+        lines: [{"index", "text", "ref_audio", "output_wav", "options"(可选)}]
+        """
+        for line in lines:
+            if line["ref_audio"] not in self.ref_hashes:
+                self.ref_hashes[line["ref_audio"]] = file_sha256(Path(line["ref_audio"]))
+
+        self.pending = deque(lines[i:i + self.batch_size] for i in range(0, len(lines), self.batch_size))
+        self.remaining = {line["index"] for line in lines}
+        self.attempts = defaultdict(int)
+        total = len(self.remaining)
+        no_worker_since = None
+
+        print(f"🛰️ 分发 {total} 行到 {len(self.workers)} 个 TTS worker（每批 {self.batch_size} 行）")
+        while self.remaining:
+            now = time.monotonic()
+            for worker in self.workers:
+                if worker["job"] is not None:
+                    self._poll_job(worker)
+                elif not worker["alive"] and now >= worker["next_probe"]:
+                    self._probe(worker)
+                if worker["alive"] and worker["job"] is None and self.pending:
+                    self._assign(worker, self.pending.popleft())
+
+            if any(w["alive"] for w in self.workers):
+                no_worker_since = None
+            elif no_worker_since is None:
+                no_worker_since = now
+            elif now - no_worker_since > self.lease_seconds:
+                raise RuntimeError("所有 TTS worker 均不可用")
+
+            if self.remaining:
+                time.sleep(self.poll_interval)
+        print(f"✅ 集群合成完成，共 {total} 行")
+
+    def _probe(self, worker: dict):
+        """对空闲或失联的 worker 发送心跳"""
+        try:
+            resp = self.session.get(f"{worker['url']}/health", timeout=self.request_timeout)
+            resp.raise_for_status()
+        except requests.RequestException:
+            worker["next_probe"] = time.monotonic() + self.heartbeat_interval
+            return
+        if not worker["alive"]:
+            print(f"🔌 worker 重新上线: {worker['url']}")
+            worker["refs"].clear()  # 重启后缓存可能已丢失，重新按需检查
+        worker["alive"] = True
+        worker["last_ok"] = time.monotonic()
+
+    def _mark_lost(self, worker: dict, reason: str):
+        print(f"⚠️ worker 失联 ({reason}): {worker['url']}")
+        worker["alive"] = False
+        worker["next_probe"] = time.monotonic() + self.heartbeat_interval
+        self._requeue(worker)
+
+    def _release(self, worker: dict):
+        """解除 worker 当前任务的租约，并尽力清理 worker 端文件"""
+        job = worker["job"]
+        worker["job"] = None
+        if job is None:
+            return
+        try:
+            self.session.delete(f"{worker['url']}/jobs/{job['id']}", timeout=self.request_timeout)
+        except requests.RequestException:
+            pass
+
+    def _requeue(self, worker: dict):
+        """将 worker 当前任务中尚未取回的行重新排队"""
+        job = worker["job"]
+        if job is None:
+            return
+        batch = [line for idx, line in job["lines"].items() if idx in self.remaining]
+        for line in batch:
+            self.attempts[line["index"]] += 1
+            if self.attempts[line["index"]] >= self.max_attempts:
+                raise RuntimeError(f"第 {line['index']} 行已重试 {self.attempts[line['index']]} 次仍失败")
+        if batch:
+            print(f"🔁 重新分配 {len(batch)} 行")
+            self.pending.appendleft(batch)
+        self._release(worker)
+
+    def _ensure_refs(self, worker: dict, batch: List[Dict]):
+        for ref_audio in {line["ref_audio"] for line in batch}:
+            ref_hash = self.ref_hashes[ref_audio]
+            if ref_hash in worker["refs"]:
+                continue
+            url = f"{worker['url']}/refs/{ref_hash}"
+            if self.session.head(url, timeout=self.request_timeout).status_code != 200:
+                with open(ref_audio, "rb") as f:
+                    self.session.put(url, data=f, timeout=self.request_timeout).raise_for_status()
+            worker["refs"].add(ref_hash)
+
+    def _assign(self, worker: dict, batch: List[Dict]):
+        job_id = uuid.uuid4().hex
+        payload = {
+            "job_id": job_id,
+            "lease_seconds": self.lease_seconds,
+            "lines": [
+                {
+                    "index": line["index"],
+                    "text": line["text"],
+                    "ref_hash": self.ref_hashes[line["ref_audio"]],
+                    "options": line.get("options", {})
+                }
+                for line in batch
+            ]
+        }
+        try:
+            self._ensure_refs(worker, batch)
+            self.session.post(f"{worker['url']}/jobs", json=payload, timeout=self.request_timeout).raise_for_status()
+        except requests.RequestException as e:
+            self.pending.appendleft(batch)
+            print(f"⚠️ 向 {worker['url']} 派发任务失败: {e}")
+            worker["alive"] = False
+            worker["next_probe"] = time.monotonic() + self.heartbeat_interval
+            return
+        worker["job"] = {"id": job_id, "lines": {line["index"]: line for line in batch}}
+        worker["last_ok"] = time.monotonic()
+
+    def _fetch_segment(self, worker: dict, job_id: str, line: Dict):
+        output = Path(line["output_wav"])
+        tmp = output.with_suffix(".part")
+        with self.session.get(
+            f"{worker['url']}/jobs/{job_id}/segments/{line['index']}", stream=True, timeout=self.request_timeout
+        ) as resp:
+            resp.raise_for_status()
+            with open(tmp, "wb") as f:
+                for chunk in resp.iter_content(chunk_size=1 << 16):
+                    f.write(chunk)
+        tmp.replace(output)
+
+    def _poll_job(self, worker: dict):
+        job = worker["job"]
+        try:
+            resp = self.session.get(f"{worker['url']}/jobs/{job['id']}", timeout=self.request_timeout)
+            if resp.status_code == 404:
+                # worker 重启或租约已在 worker 端过期
+                print(f"⚠️ worker 上的任务已丢失: {worker['url']}")
+                self._requeue(worker)
+                return
+            resp.raise_for_status()
+            status = resp.json()
+            worker["last_ok"] = time.monotonic()
+
+            for idx in status["completed"]:
+                if idx in self.remaining and idx in job["lines"]:
+                    self._fetch_segment(worker, job["id"], job["lines"][idx])
+                    self.remaining.discard(idx)
+        except requests.RequestException as e:
+            if time.monotonic() - worker["last_ok"] > self.lease_seconds:
+                self._mark_lost(worker, str(e))
+            return
+
+        if status["state"] == "done" and not any(idx in self.remaining for idx in job["lines"]):
+            done = len(job["lines"])
+            self._release(worker)
+            print(f"📥 {worker['url']} 完成 {done} 行，剩余 {len(self.remaining)} 行")
+        elif status["state"] in ("failed", "expired", "cancelled"):
+            print(f"⚠️ {worker['url']} 任务{status['state']}: {status.get('error')}")
+            self._requeue(worker)
+
+
+def synthesize_on_farm(lines: List[Dict], farm_cfg: dict):
+    """按 config.json 中的 tts_farm 配置在多个 worker 上合成"""
+    coordinator = TTSFarmCoordinator(
+        workers=farm_cfg["workers"],
+        batch_size=farm_cfg.get("batch_size", 8),
+        lease_seconds=farm_cfg.get("lease_seconds", 60.0),
+        poll_interval=farm_cfg.get("poll_interval", 0.5),
+        heartbeat_interval=farm_cfg.get("heartbeat_interval", 5.0),
+        max_attempts=farm_cfg.get("max_attempts", 3)
+    )
+    coordinator.synthesize(lines)
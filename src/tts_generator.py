@@ -2,50 +2,24 @@ import json
 import os
 import tempfile
 import subprocess
+import time
 from pathlib import Path
-from pydub import AudioSegment
-from . import NOVELS_DIR
-
-def generate_tts_audio(novel_name: str, chapter_id: str):
+from typing import Dict, List
+from . import CONFIG_DIR, NOVELS_DIR
+from .audio_postprocess import SEGMENT_INDEX_NAME, assemble_chapter, save_segment_index
+from .emotion_vectors import load_emotion_config, precompute_emotions
+from .role_alias import load_alias_index, resolve_role
+from .run_estimator import STAGE_TTS, record_run
+from .tts_farm import synthesize_on_farm
+
+def load_config():
+    with open(CONFIG_DIR, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def synthesize_local(task: dict, B_DIR: Path):
     """
-    根据 script.json 和 role_to_voice.json 生成有声剧
+    在本机 INDEXTTS_PATH 下以子进程方式批量合成 task["lines"]
     """
-    INDEXTTS_PATH = os.environ.get("INDEXTTS_PATH", "/root/index-tts")
-    B_DIR = Path(INDEXTTS_PATH)
-
-    NOVEL_DIR = NOVELS_DIR / novel_name
-    CHAPTER_DIR = NOVEL_DIR / "chapters" / chapter_id
-    SEGMENTS_DIR = CHAPTER_DIR / "segments"
-
-    SCRIPT_PATH = CHAPTER_DIR / "script.json"
-    ROLE_MAP_PATH = NOVEL_DIR / "role_to_voice.json"
-
-    for p, name in [(SCRIPT_PATH, "剧本"), (ROLE_MAP_PATH, "角色音色映射")]:
-        if not p.exists():
-            raise FileNotFoundError(f"{name}不存在: {p}")
-
-    SEGMENTS_DIR.mkdir(parents=True, exist_ok=True)
-
-    with open(SCRIPT_PATH, "r", encoding="utf-8") as f:
-        script_data = json.load(f)
-    with open(ROLE_MAP_PATH, "r", encoding="utf-8") as f:
-        role_map = json.load(f)
-
-    task = {"lines": []}
-    for i, line in enumerate(script_data["lines"]):
-        role = line["role"]
-        if role not in role_map:
-            raise ValueError(f"角色 '{role}' 未定义")
-        ref_audio_abs = (B_DIR / role_map[role]).resolve()
-        if not ref_audio_abs.exists():
-            raise FileNotFoundError(f"参考音频不存在: {ref_audio_abs}")
-        task["lines"].append({
-            "index": i,
-            "text": line["text"],
-            "ref_audio": str(ref_audio_abs),
-            "output_wav": str(SEGMENTS_DIR / f"segment_{i:03d}.wav")
-        })
-
     # 写入临时任务文件
     with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False, dir=B_DIR, encoding='utf-8') as tmpf:
         json.dump(task, tmpf, ensure_ascii=False, indent=2)
@@ -68,12 +42,15 @@ tts = IndexTTS2(
 )
 
 for item in task["lines"]:
+    # 有预计算的情感向量时直接传入，否则由模型逐行推理文本情感
+    emo_vector = item.get("options", {{}}).get("emo_vector")
     tts.infer(
         spk_audio_prompt=item["ref_audio"],
         text=item["text"],
         output_path=item["output_wav"],
         emo_alpha=0.3,
-        use_emo_text=True,
+        emo_vector=emo_vector,
+        use_emo_text=emo_vector is None,
         use_random=True,
         verbose=False
     )
@@ -90,14 +67,102 @@ for item in task["lines"]:
         task_json_path.unlink(missing_ok=True)
         batch_script_path.unlink(missing_ok=True)
 
-    # 拼接音频
-    combined = AudioSegment.empty()
-    for i in range(len(script_data["lines"])):
-        seg = AudioSegment.from_wav(SEGMENTS_DIR / f"segment_{i:03d}.wav")
-        combined += seg + AudioSegment.silent(duration=500)
+def resolve_line_roles(novel_name: str, lines: List[Dict], role_map: Dict) -> List[Dict]:
+    """别名（如“韩兄”）解析为规范角色后再查音色"""
+    characters_path = NOVELS_DIR / novel_name / "characters.json"
+    characters = []
+    if characters_path.exists():
+        with open(characters_path, "r", encoding="utf-8") as f:
+            characters = json.load(f)
+    alias_index = load_alias_index(novel_name)
+    resolved_lines = []
+    for line in lines:
+        role = line["role"]
+        if role not in role_map:
+            char = resolve_role(role, characters, alias_index)
+            if char is not None:
+                role = char["role"]
+        resolved_lines.append({**line, "role": role})
+    return resolved_lines
+
+
+def build_tts_line(index: int, line: Dict, role_map: Dict, B_DIR: Path, SEGMENTS_DIR: Path) -> Dict:
+    role = line["role"]
+    if role not in role_map:
+        raise ValueError(f"角色 '{role}' 未定义")
+    ref_audio_abs = (B_DIR / role_map[role]).resolve()
+    if not ref_audio_abs.exists():
+        raise FileNotFoundError(f"参考音频不存在: {ref_audio_abs}")
+    return {
+        "index": index,
+        "text": line["text"],
+        "ref_audio": str(ref_audio_abs),
+        "output_wav": str(SEGMENTS_DIR / f"segment_{index:03d}.wav")
+    }
+
+
+def attach_emotion_vectors(novel_name: str, chapter_id: str, task_lines: List[Dict]):
+    """分批预计算情感向量（缓存于 emotions.json），合成时不再逐行运行文本情感模型"""
+    if not load_emotion_config()["precompute"]:
+        return
+    try:
+        emo_vectors = precompute_emotions(novel_name, chapter_id)
+    except (subprocess.CalledProcessError, OSError) as e:
+        print(f"⚠️ 情感向量预计算失败，改为逐行推理: {e}")
+        return
+    for item in task_lines:
+        item["options"] = {"emo_vector": emo_vectors[item["index"]], "use_emo_text": False}
+
+
+def synthesize_lines(task_lines: List[Dict], B_DIR: Path):
+    """配置了 tts_farm.workers 时分发到多个 worker，否则在本机运行"""
+    farm_cfg = load_config().get("tts_farm", {})
+    if farm_cfg.get("workers"):
+        synthesize_on_farm(task_lines, farm_cfg)
+    else:
+        synthesize_local({"lines": task_lines}, B_DIR)
+
+
+def generate_tts_audio(novel_name: str, chapter_id: str):
+    """
+    根据 script.json 和 role_to_voice.json 生成有声剧
+    """
+    INDEXTTS_PATH = os.environ.get("INDEXTTS_PATH", "/root/index-tts")
+    B_DIR = Path(INDEXTTS_PATH)
+
+    NOVEL_DIR = NOVELS_DIR / novel_name
+    CHAPTER_DIR = NOVEL_DIR / "chapters" / chapter_id
+    SEGMENTS_DIR = CHAPTER_DIR / "segments"
+
+    SCRIPT_PATH = CHAPTER_DIR / "script.json"
+    ROLE_MAP_PATH = NOVEL_DIR / "role_to_voice.json"
+
+    for p, name in [(SCRIPT_PATH, "剧本"), (ROLE_MAP_PATH, "角色音色映射")]:
+        if not p.exists():
+            raise FileNotFoundError(f"{name}不存在: {p}")
+
+    SEGMENTS_DIR.mkdir(parents=True, exist_ok=True)
+    start = time.perf_counter()
+
+    with open(SCRIPT_PATH, "r", encoding="utf-8") as f:
+        script_data = json.load(f)
+    with open(ROLE_MAP_PATH, "r", encoding="utf-8") as f:
+        role_map = json.load(f)
+
+    resolved_lines = resolve_line_roles(novel_name, script_data["lines"], role_map)
+    task_lines = [build_tts_line(i, line, role_map, B_DIR, SEGMENTS_DIR) for i, line in enumerate(resolved_lines)]
+
+    attach_emotion_vectors(novel_name, chapter_id, task_lines)
+    synthesize_lines(task_lines, B_DIR)
+
+    # 后处理并拼接音频（裁剪静音、响度归一化、按标点与换角色调整停顿），
+    # 同时记录每行在整章中的采样偏移，供单行重新合成时原位替换
+    segment_paths = [SEGMENTS_DIR / f"segment_{i:03d}.wav" for i in range(len(script_data["lines"]))]
     final_output = CHAPTER_DIR / "full_drama.wav"
-    combined.export(final_output, format="wav")
+    index = assemble_chapter(segment_paths, resolved_lines, final_output)
+    save_segment_index(CHAPTER_DIR / SEGMENT_INDEX_NAME, index)
     print(f"✅ 有声剧生成完成: {final_output}")
+    record_run(novel_name, chapter_id, STAGE_TTS, time.perf_counter() - start)
     return str(final_output)
 
 
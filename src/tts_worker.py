@@ -0,0 +1,366 @@
+"""
+TTS 工作节点：通过简单的 HTTP 接口接收协调端下发的合成任务。
+
+仅依赖标准库，可直接在 index-tts 的环境中运行：
+    cd $INDEXTTS_PATH && uv run python /path/to/src/tts_worker.py --port 9001
+本机测试可使用桩合成器：
+    python src/tts_worker.py --port 9001 --synth stub
+
+接口：
+    GET    /health                         心跳，返回节点状态
+    HEAD   /refs/{sha256}                  参考音频是否已缓存
+    PUT    /refs/{sha256}                  上传参考音频（按内容哈希校验并缓存）
+    POST   /jobs                           提交任务 {"job_id", "lease_seconds", "lines": [{"index", "text", "ref_hash", "options"}]}
+    GET    /jobs/{job_id}                  查询进度（同时续租），返回 {"state", "completed", "error"}
+    GET    /jobs/{job_id}/segments/{index} 下载已完成的片段
+    DELETE /jobs/{job_id}                  取消任务并清理文件
+
+默认只监听 127.0.0.1；多机部署时用 --host 0.0.0.0（或内网地址）显式开放。
+超过租期未被查询的任务（包括已完成或失败的）会被自动清理。
+"""
+import hashlib
+import json
+import math
+import os
+import queue
+import re
+import shutil
+import socket
+import struct
+import sys
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+MAX_REF_BYTES = 64 * 1024 * 1024  # 参考音频上传大小上限
+REAP_INTERVAL = 5  # 检查过期任务的间隔（秒）
+
+
+class StubSynthesizer:
+    """桩合成器：按文本长度生成一段正弦音，用于在单机上测试调度逻辑"""
+
+    def __init__(self, delay: float = 0.0, sample_rate: int = 22050):
+        self.delay = delay
+        self.sample_rate = sample_rate
+
+    def synthesize(self, text: str, ref_path: Path, output_path: Path, **options):
+        if self.delay:
+            time.sleep(self.delay)
+        freq = 200 + int(hashlib.sha256(ref_path.name.encode()).hexdigest()[:4], 16) % 300
+        n = int(self.sample_rate * min(0.1 * max(len(text), 1), 10.0))
+        frames = b"".join(
+            struct.pack("<h", int(8000 * math.sin(2 * math.pi * freq * i / self.sample_rate)))
+            for i in range(n)
+        )
+        with wave.open(str(output_path), "wb") as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(self.sample_rate)
+            w.writeframes(frames)
+
+
+class IndexTTSSynthesizer:
+    """在当前进程中常驻 IndexTTS2 模型（需在 index-tts 目录及其环境下运行）"""
+
+    DEFAULT_OPTIONS = {
+        "emo_alpha": 0.3,
+        "use_emo_text": True,
+        "use_random": True,
+        "verbose": False
+    }
+
+    def __init__(self):
+        sys.path.insert(0, os.getcwd())
+        from indextts.infer_v2 import IndexTTS2
+        self.tts = IndexTTS2(
+            cfg_path="checkpoints/config.yaml",
+            model_dir="checkpoints",
+            use_fp16=True,
+            use_cuda_kernel=False,
+            use_deepspeed=False
+        )
+
+    def synthesize(self, text: str, ref_path: Path, output_path: Path, **options):
+        kwargs = {**self.DEFAULT_OPTIONS, **options}
+        self.tts.infer(spk_audio_prompt=str(ref_path), text=text, output_path=str(output_path), **kwargs)
+
+
+class TTSWorker:
+    """管理参考音频缓存与任务队列，单线程顺序合成"""
+
+    def __init__(self, synthesizer, cache_dir: Path, worker_id: str = None):
+        self.synthesizer = synthesizer
+        self.worker_id = worker_id or socket.gethostname()
+        self.refs_dir = cache_dir / "refs"
+        self.jobs_dir = cache_dir / "jobs"
+        self.refs_dir.mkdir(parents=True, exist_ok=True)
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+        threading.Thread(target=self._reap, daemon=True).start()
+
+    def ref_path(self, ref_hash: str) -> Path:
+        return self.refs_dir / f"{ref_hash}.wav"
+
+    def store_ref(self, ref_hash: str, stream, length: int):
+        """从 stream 分块读取 length 字节写入临时文件，边写边校验哈希，校验通过后放入缓存"""
+        if not re.fullmatch(r"[0-9a-f]{64}", ref_hash):
+            raise ValueError(f"非法的参考音频哈希: {ref_hash}")
+        digest = hashlib.sha256()
+        tmp = self.refs_dir / f"{ref_hash}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                remaining = length
+                while remaining > 0:
+                    chunk = stream.read(min(remaining, 1024 * 1024))
+                    if not chunk:
+                        raise ValueError("参考音频上传不完整")
+                    digest.update(chunk)
+                    f.write(chunk)
+                    remaining -= len(chunk)
+            if digest.hexdigest() != ref_hash:
+                raise ValueError("参考音频哈希不匹配")
+            tmp.replace(self.ref_path(ref_hash))
+        finally:
+            tmp.unlink(missing_ok=True)
+
+    def submit(self, job: dict):
+        if not re.fullmatch(r"[\w-]+", job["job_id"]):
+            raise ValueError(f"非法的任务 ID: {job['job_id']}")
+        missing = sorted({line["ref_hash"] for line in job["lines"] if not self.ref_path(line["ref_hash"]).exists()})
+        if missing:
+            raise ValueError(f"缺少参考音频: {missing}")
+        job_dir = self.jobs_dir / job["job_id"]
+        job_dir.mkdir(exist_ok=True)
+        with self.lock:
+            self.jobs[job["job_id"]] = {
+                "lines": job["lines"],
+                "lease_seconds": job.get("lease_seconds", 60),
+                "last_seen": time.monotonic(),
+                "state": "queued",
+                "completed": [],
+                "error": None,
+                "dir": job_dir
+            }
+        self.queue.put(job["job_id"])
+
+    def status(self, job_id: str) -> dict:
+        with self.lock:
+            job = self.jobs[job_id]
+            job["last_seen"] = time.monotonic()
+            return {"state": job["state"], "completed": list(job["completed"]), "error": job["error"]}
+
+    def segment_path(self, job_id: str, index: int) -> Path:
+        return self.jobs[job_id]["dir"] / f"segment_{index:03d}.wav"
+
+    def cancel(self, job_id: str):
+        with self.lock:
+            job = self.jobs.pop(job_id, None)
+        if job is not None:
+            job["state"] = "cancelled"
+            shutil.rmtree(job["dir"], ignore_errors=True)
+
+    def busy(self) -> int:
+        with self.lock:
+            return sum(job["state"] in ("queued", "running") for job in self.jobs.values())
+
+    def _lease_expired(self, job: dict) -> bool:
+        return time.monotonic() - job["last_seen"] > job["lease_seconds"]
+
+    def expire_stale(self) -> list:
+        """清理租约已过期的任务（运行中的由合成线程在下一行之前处理），返回被清理的任务 ID"""
+        with self.lock:
+            stale = [
+                job_id for job_id, job in self.jobs.items()
+                if job["state"] != "running" and self._lease_expired(job)
+            ]
+        for job_id in stale:
+            print(f"⚠️ 任务 {job_id} 租约过期，已清理")
+            self.cancel(job_id)
+        return stale
+
+    def _reap(self):
+        while True:
+            time.sleep(REAP_INTERVAL)
+            self.expire_stale()
+
+    def _run(self):
+        while True:
+            job_id = self.queue.get()
+            job = self.jobs.get(job_id)
+            if job is None or job["state"] == "cancelled":
+                continue
+            job["state"] = "running"
+            try:
+                for line in job["lines"]:
+                    if job["state"] == "cancelled":
+                        break
+                    # 协调端超过租期未来查询，视为租约失效，放弃剩余工作
+                    if self._lease_expired(job):
+                        job["state"] = "expired"
+                        break
+                    output = job["dir"] / f"segment_{line['index']:03d}.wav"
+                    tmp = output.with_suffix(".tmp.wav")
+                    self.synthesizer.synthesize(
+                        line["text"], self.ref_path(line["ref_hash"]), tmp, **line.get("options", {})
+                    )
+                    tmp.replace(output)
+                    with self.lock:
+                        job["completed"].append(line["index"])
+                else:
+                    job["state"] = "done"
+            except Exception as e:
+                if job["state"] != "cancelled":
+                    job["state"] = "failed"
+                    job["error"] = str(e)
+                    print(f"❌ 任务 {job_id} 失败: {e}")
+            if job["state"] == "expired":
+                print(f"⚠️ 任务 {job_id} 租约过期，已放弃")
+                self.cancel(job_id)
+
+
+def make_handler(worker: TTSWorker):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, code: int, payload: dict):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_body(self) -> bytes:
+            return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        def _content_length(self):
+            try:
+                return int(self.headers["Content-Length"])
+            except (TypeError, ValueError):
+                return None
+
+        def _parts(self):
+            return [p for p in self.path.split("/") if p]
+
+        def do_GET(self):
+            parts = self._parts()
+            if parts == ["health"]:
+                return self._send_json(200, {"status": "ok", "worker_id": worker.worker_id, "busy": worker.busy()})
+            if len(parts) == 2 and parts[0] == "jobs":
+                try:
+                    return self._send_json(200, worker.status(parts[1]))
+                except KeyError:
+                    return self._send_json(404, {"error": "job not found"})
+            if len(parts) == 4 and parts[0] == "jobs" and parts[2] == "segments" and parts[3].isdigit():
+                try:
+                    f = open(worker.segment_path(parts[1], int(parts[3])), "rb")
+                except KeyError:
+                    return self._send_json(404, {"error": "job not found"})
+                except FileNotFoundError:
+                    return self._send_json(404, {"error": "segment not ready"})
+                with f:
+                    self.send_response(200)
+                    self.send_header("Content-Type", "audio/wav")
+                    self.send_header("Content-Length", str(os.fstat(f.fileno()).st_size))
+                    self.end_headers()
+                    shutil.copyfileobj(f, self.wfile)
+                return
+            self._send_json(404, {"error": "not found"})
+
+        def do_HEAD(self):
+            parts = self._parts()
+            exists = (
+                len(parts) == 2 and parts[0] == "refs"
+                and re.fullmatch(r"[0-9a-f]{64}", parts[1]) is not None
+                and worker.ref_path(parts[1]).exists()
+            )
+            self.send_response(200 if exists else 404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def do_PUT(self):
+            parts = self._parts()
+            if len(parts) != 2 or parts[0] != "refs":
+                return self._send_json(404, {"error": "not found"})
+            length = self._content_length()
+            if length is None or length < 0:
+                self.close_connection = True
+                return self._send_json(411, {"error": "Content-Length required"})
+            if length > MAX_REF_BYTES:
+                self.close_connection = True
+                return self._send_json(413, {"error": f"参考音频超过 {MAX_REF_BYTES} 字节上限"})
+            try:
+                worker.store_ref(parts[1], self.rfile, length)
+            except ValueError as e:
+                self.close_connection = True
+                return self._send_json(400, {"error": str(e)})
+            self._send_json(201, {"ref_hash": parts[1]})
+
+        def do_POST(self):
+            if self._parts() != ["jobs"]:
+                return self._send_json(404, {"error": "not found"})
+            try:
+                worker.submit(json.loads(self._read_body()))
+            except (ValueError, KeyError) as e:
+                return self._send_json(400, {"error": str(e)})
+            self._send_json(202, {"accepted": True})
+
+        def do_DELETE(self):
+            parts = self._parts()
+            if len(parts) != 2 or parts[0] != "jobs":
+                return self._send_json(404, {"error": "not found"})
+            worker.cancel(parts[1])
+            self._send_json(200, {"deleted": True})
+
+    return Handler
+
+
+def serve_worker(
+    host: str = "127.0.0.1",
+    port: int = 9001,
+    synth: str = "indextts",
+    cache_dir: str = None,
+    stub_delay: float = 0.0,
+    worker_id: str = None
+):
+    """启动 TTS 工作节点（阻塞运行）"""
+    if synth == "stub":
+        synthesizer = StubSynthesizer(delay=stub_delay)
+    elif synth == "indextts":
+        synthesizer = IndexTTSSynthesizer()
+    else:
+        raise ValueError(f"未知的合成器: {synth}")
+    cache = Path(cache_dir) if cache_dir else Path.home() / ".cache" / "ainovelcast-worker" / str(port)
+    worker = TTSWorker(synthesizer, cache, worker_id=worker_id)
+    server = ThreadingHTTPServer((host, port), make_handler(worker))
+    print(f"🛰️ TTS worker [{worker.worker_id}] 已启动: http://{host}:{port} （合成器: {synth}，缓存: {cache}）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def add_worker_arguments(parser):
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址（多机部署时设为 0.0.0.0 或内网地址）")
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--synth", default="indextts", choices=["indextts", "stub"], help="合成器（stub 用于本机测试）")
+    parser.add_argument("--cache_dir", help="参考音频与片段缓存目录（默认 ~/.cache/ainovelcast-worker/{port}）")
+    parser.add_argument("--stub_delay", type=float, default=0.0, help="桩合成器每行的模拟耗时（秒）")
+    parser.add_argument("--worker_id", help="节点标识（默认主机名）")
+
+
+# ====== CLI 入口 ======
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="启动 TTS 工作节点")
+    add_worker_arguments(parser)
+    args = parser.parse_args()
+    serve_worker(args.host, args.port, args.synth, args.cache_dir, args.stub_delay, args.worker_id)
@@ -0,0 +1,208 @@
+"""
+API 用量账本：记录每次大模型调用的 token 用量与每次 MiniMax 音色设计调用，按小说 / 章节 / 阶段汇总，
+并按 config.json 中的预算在批量处理时自动降速或停止。仅依赖标准库（sqlite3）。
+
+config.json 示例：
+    "usage": {
+        "prices": {
+            "deepseek-chat": {"prompt": 2.0, "completion": 8.0},   # 每百万 token 的价格
+            "voice_design": 0.5                                    # 每次音色设计的价格
+        },
+        "budget": {
+            "novel_tokens": 5000000, "day_tokens": 2000000,        # token 上限
+            "novel_cost": 50, "day_cost": 20,                       # 费用上限（需配置 prices）
+            "slow_ratio": 0.8,                                      # 超过该比例后每章之间等待 slow_seconds
+            "slow_seconds": 30
+        }
+    }
+"""
+import json
+import sqlite3
+import time
+from contextlib import closing
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+from . import CONFIG_DIR, DATA_DIR
+
+LEDGER_PATH = DATA_DIR / "usage.db"
+
+STAGE_SCRIPT = "novel_to_script"
+STAGE_PROFILE = "character_profile"
+STAGE_VOICE = "voice_design"
+
+DEFAULT_BUDGET = {
+    "novel_tokens": None,
+    "day_tokens": None,
+    "novel_cost": None,
+    "day_cost": None,
+    "slow_ratio": 0.8,
+    "slow_seconds": 30
+}
+
+
+class BudgetExceeded(RuntimeError):
+    """已达到配置的用量预算"""
+
+
+def load_usage_config() -> dict:
+    cfg = {"prices": {}, "budget": dict(DEFAULT_BUDGET)}
+    if CONFIG_DIR.exists():
+        with open(CONFIG_DIR, "r", encoding="utf-8") as f:
+            user_cfg = json.load(f).get("usage", {})
+        cfg["prices"].update(user_cfg.get("prices", {}))
+        cfg["budget"].update(user_cfg.get("budget", {}))
+    return cfg
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(LEDGER_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS usage (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts REAL NOT NULL,
+            day TEXT NOT NULL,
+            novel TEXT NOT NULL,
+            chapter TEXT,
+            stage TEXT NOT NULL,
+            model TEXT,
+            prompt_tokens INTEGER NOT NULL DEFAULT 0,
+            completion_tokens INTEGER NOT NULL DEFAULT 0,
+            calls INTEGER NOT NULL DEFAULT 1,
+            cost REAL NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_usage_novel ON usage (novel, stage);
+        CREATE INDEX IF NOT EXISTS idx_usage_day ON usage (day);
+    """)
+    return conn
+
+
+def estimate_cost(stage: str, model: Optional[str], prompt_tokens: int, completion_tokens: int, prices: dict) -> float:
+    if stage == STAGE_VOICE:
+        return float(prices.get(STAGE_VOICE, 0.0))
+    price = prices.get(model or "", {})
+    return (prompt_tokens * price.get("prompt", 0.0) + completion_tokens * price.get("completion", 0.0)) / 1_000_000
+
+
+def record_usage(
+    novel_name: str,
+    chapter_id: Optional[str],
+    stage: str,
+    model: Optional[str] = None,
+    prompt_tokens: int = 0,
+    completion_tokens: int = 0
+):
+    """写入一条用量记录，费用按当前配置的单价计算"""
+    cost = estimate_cost(stage, model, prompt_tokens, completion_tokens, load_usage_config()["prices"])
+    with closing(_connect()) as conn, conn:
+        conn.execute(
+            "INSERT INTO usage (ts, day, novel, chapter, stage, model, prompt_tokens, completion_tokens, cost)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (time.time(), date.today().isoformat(), novel_name, chapter_id, stage, model,
+             prompt_tokens, completion_tokens, cost)
+        )
+
+
+def record_completion(novel_name: str, chapter_id: Optional[str], stage: str, model: str, completion):
+    """记录 OpenAI 格式 completion 的 usage；接口未返回 usage 时只记调用次数"""
+    usage = getattr(completion, "usage", None)
+    record_usage(
+        novel_name, chapter_id, stage, model,
+        prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+        completion_tokens=getattr(usage, "completion_tokens", 0) or 0
+    )
+
+
+def _totals(where: str = "", params: tuple = ()) -> Dict:
+    with closing(_connect()) as conn:
+        row = conn.execute(
+            "SELECT COUNT(*) AS records, COALESCE(SUM(calls), 0) AS calls,"
+            " COALESCE(SUM(prompt_tokens), 0) AS prompt_tokens,"
+            " COALESCE(SUM(completion_tokens), 0) AS completion_tokens,"
+            f" COALESCE(SUM(cost), 0) AS cost FROM usage {where}",
+            params
+        ).fetchone()
+    totals = dict(row)
+    totals["tokens"] = totals["prompt_tokens"] + totals["completion_tokens"]
+    return totals
+
+
+def novel_totals(novel_name: str) -> Dict:
+    return _totals("WHERE novel = ?", (novel_name,))
+
+
+def day_totals(day: Optional[str] = None) -> Dict:
+    return _totals("WHERE day = ?", (day or date.today().isoformat(),))
+
+
+def summarize(group_by: List[str], novel_name: Optional[str] = None, days: Optional[int] = None) -> List[Dict]:
+    """按 novel / chapter / stage / model / day 的任意组合汇总"""
+    allowed = {"novel", "chapter", "stage", "model", "day"}
+    if not group_by or not set(group_by) <= allowed:
+        raise ValueError(f"group_by 只能取 {sorted(allowed)}")
+    cols = ", ".join(group_by)
+    conditions, params = [], []
+    if novel_name:
+        conditions.append("novel = ?")
+        params.append(novel_name)
+    if days:
+        conditions.append("day >= ?")
+        params.append((date.today() - timedelta(days=days - 1)).isoformat())
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    with closing(_connect()) as conn:
+        rows = conn.execute(
+            f"SELECT {cols}, SUM(calls) AS calls, SUM(prompt_tokens) AS prompt_tokens,"
+            f" SUM(completion_tokens) AS completion_tokens, ROUND(SUM(cost), 4) AS cost"
+            f" FROM usage {where} GROUP BY {cols} ORDER BY {cols}",
+            params
+        ).fetchall()
+    return [dict(row) for row in rows]
+
+
+def budget_status(novel_name: str) -> List[Dict]:
+    """返回已配置预算的使用情况 [{"name", "used", "limit", "ratio"}]"""
+    budget = load_usage_config()["budget"]
+    novel, today = novel_totals(novel_name), day_totals()
+    status = []
+    for name, totals, key in [
+        ("novel_tokens", novel, "tokens"), ("day_tokens", today, "tokens"),
+        ("novel_cost", novel, "cost"), ("day_cost", today, "cost")
+    ]:
+        limit = budget.get(name)
+        if limit:
+            status.append({"name": name, "used": totals[key], "limit": limit, "ratio": totals[key] / limit})
+    return status
+
+
+def check_budget(novel_name: str):
+    """每次付费调用前调用：已达到任一预算时抛出 BudgetExceeded（不等待）"""
+    exceeded = [s for s in budget_status(novel_name) if s["ratio"] >= 1.0]
+    if exceeded:
+        detail = "，".join(f"{s['name']} {s['used']:g}/{s['limit']:g}" for s in exceeded)
+        raise BudgetExceeded(f"已达到用量预算（{detail}），停止处理")
+
+
+def enforce_budget(novel_name: str, sleep=time.sleep):
+    """
+    批量处理每章开始前调用：达到任一预算时抛出 BudgetExceeded；
+    超过 slow_ratio 时等待 slow_seconds 再继续，给人工介入留出时间
+    """
+    check_budget(novel_name)
+    budget = load_usage_config()["budget"]
+    status = budget_status(novel_name)
+    near = [s for s in status if s["ratio"] >= budget["slow_ratio"]]
+    if near and budget["slow_seconds"]:
+        detail = "，".join(f"{s['name']} {s['ratio']:.0%}" for s in near)
+        print(f"🐢 用量接近预算（{detail}），等待 {budget['slow_seconds']} 秒后继续")
+        sleep(budget["slow_seconds"])
+
+
+# ====== CLI 入口 ======
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="查看 API 用量")
+    parser.add_argument("--novel", help="小说名称（可选）")
+    parser.add_argument("--days", type=int, help="只统计最近 N 天")
+    args = parser.parse_args()
+    for row in summarize(["novel", "stage"], args.novel, args.days):
+        print(row)
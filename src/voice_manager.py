@@ -5,6 +5,7 @@ from pathlib import Path
 from datetime import datetime
 from typing import Dict, Optional
 from . import CONFIG_DIR, NOVELS_DIR, VOICE_DIR
+from .usage_ledger import STAGE_VOICE, BudgetExceeded, check_budget, record_usage
 
 def load_config():
     with open(CONFIG_DIR, "r", encoding="utf-8") as f:
@@ -27,6 +28,7 @@ def generate_voice_for_role(
     config: dict,
     voice_library_dir: Path,
     metadata_path: Path,
+    novel_name: str = "",
     preview_text: str = "人生就像海洋，只有意志坚强的人才能到达彼岸。"
 ) -> str:
     """
@@ -42,6 +44,7 @@ def generate_voice_for_role(
         "preview_text": preview_text
     }
 
+    check_budget(novel_name)
     response = requests.post(
         api_cfg["url"],
         json=payload,
@@ -54,6 +57,8 @@ def generate_voice_for_role(
         msg = resp_json.get("base_resp", {}).get("status_msg", "Unknown error")
         raise RuntimeError(f"MiniMax API 错误: {msg}")
 
+    record_usage(novel_name, None, STAGE_VOICE)
+
     hex_audio = resp_json["trial_audio"]
     voice_id = resp_json["voice_id"]
 
@@ -114,6 +119,7 @@ def sync_role_to_voice(novel_name: str, config_path: Optional[Path] = None):
         role_to_voice = {}
 
     updated = False
+    budget_error = None
     for char in characters:
         role = char["role"]
         description = char["descript"]
@@ -131,11 +137,16 @@ def sync_role_to_voice(novel_name: str, config_path: Optional[Path] = None):
                 description=description,
                 config=config,
                 voice_library_dir=voice_library_dir,
-                metadata_path=metadata_path
+                metadata_path=metadata_path,
+                novel_name=novel_name
             )
             role_to_voice[role] = wav_path
             updated = True
             print(f"✨ 已为 '{role}' 生成音色: {wav_path}")
+        except BudgetExceeded as e:
+            print(f"⛔ {e}")
+            budget_error = e
+            break
         except Exception as e:
             print(f"❌ 生成 '{role}' 音色失败: {e}")
             continue
@@ -147,6 +158,8 @@ def sync_role_to_voice(novel_name: str, config_path: Optional[Path] = None):
     else:
         print("ℹ️ 无新角色需要生成音色")
 
+    if budget_error is not None:
+        raise budget_error
     return str(role_to_voice_path)
 
 
@@ -2,15 +2,20 @@ import streamlit as st
 from pathlib import Path
 import json
 import re
+import time
 from src import (
     init_novel,
     convert_novel_to_script,
     manage_characters,
     sync_role_to_voice,
     generate_tts_audio,
+    export_audiobook,
+    rerender_line,
     NOVELS_DIR,
     VOICE_DIR
 )
+from src.usage_ledger import BudgetExceeded, budget_status, enforce_budget, summarize
+from src.run_estimator import BatchProgress, format_duration, predict_chapters, prediction_accuracy
 
 # 页面配置
 st.set_page_config(page_title="AINovelCast - 有声小说生成器", layout="wide")
@@ -46,7 +51,7 @@ with st.sidebar:
         st.info("暂无小说")
 
 # ========== 主区域：功能面板 ==========
-tab1, tab2, tab3 = st.tabs(["📥 初始化小说", "⚙️ 生成章节音频", "🎭 自定义角色音色"])
+tab1, tab2, tab3, tab4 = st.tabs(["📥 初始化小说", "⚙️ 生成章节音频", "🎭 自定义角色音色", "📊 API 用量"])
 
 # --- Tab 1: 上传小说 ---
 with tab1:
@@ -61,6 +66,12 @@ with tab1:
         value=r"^[ \t\u3000]*(?:第)?[零一二三四五六七八九十百千\d]{1,10}[章话节]"
     )
 
+    max_tokens = st.number_input(
+        "每个处理单元的 token 上限（0 表示不重新分块）",
+        min_value=0, value=0, step=500,
+        help="超长章节按段落拆分、过短章节与相邻章节合并，使每次调用大模型的输入大小均衡"
+    )
+
     if st.button("初始化小说") and novel_file and novel_name and chapter_pattern:
         upload_path = Path("data/upload") / f"{novel_name}.txt"
         upload_path.parent.mkdir(parents=True, exist_ok=True)
@@ -71,7 +82,8 @@ with tab1:
             init_novel(
                 novel_file=str(upload_path),
                 chapter_pattern=chapter_pattern,
-                novel_name=novel_name
+                novel_name=novel_name,
+                max_tokens=int(max_tokens) or None
             )
             st.success(f"✅ 小说 [{novel_name}] 初始化成功！")
             st.rerun()
@@ -102,6 +114,40 @@ with tab2:
         else:
             st.warning("⏳ 音频尚未生成")
 
+        # --- 单行重新合成 ---
+        script_file = ch_path / "script.json"
+        if audio_exists and script_file.exists():
+            with st.expander("✏️ 单行重新合成（不重新生成剧本）"):
+                with open(script_file, encoding="utf-8") as f:
+                    script_lines = json.load(f)["lines"]
+                line_idx = st.selectbox(
+                    "选择台词",
+                    range(len(script_lines)),
+                    format_func=lambda i: f"{i}. [{script_lines[i]['role']}] {script_lines[i]['text'][:40]}",
+                    key="rerender_line"
+                )
+                new_text = st.text_area("台词", value=script_lines[line_idx]["text"], key=f"rerender_text_{line_idx}")
+                role_map_path = NOVELS_DIR / selected_novel / "role_to_voice.json"
+                voice_roles = []
+                if role_map_path.exists():
+                    with open(role_map_path, encoding="utf-8") as f:
+                        voice_roles = sorted(json.load(f))
+                current_role = script_lines[line_idx]["role"]
+                role_options = [current_role] + [r for r in voice_roles if r != current_role]
+                new_role = st.selectbox("角色音色", role_options, key=f"rerender_role_{line_idx}")
+                if st.button("🔁 重新合成该行"):
+                    with st.spinner("正在重新合成..."):
+                        try:
+                            result = rerender_line(
+                                selected_novel, selected_chapter, line_idx,
+                                text=new_text if new_text != script_lines[line_idx]["text"] else None,
+                                role=new_role if new_role != current_role else None
+                            )
+                            st.success("✅ 已原位替换" if result["in_place"] else "✅ 已替换，其后音频已平移")
+                            st.rerun()
+                        except Exception as e:
+                            st.error(f"❌ 重新合成失败: {e}")
+
         if st.button("🚀 生成本章音频"):
             with st.spinner("正在处理中，请稍候..."):
                 try:
@@ -136,22 +182,37 @@ with tab2:
                 start_idx, end_idx = end_idx, start_idx
             batch_chapters = all_chapters[start_idx:end_idx+1]
 
-            st.write(f"将处理 {len(batch_chapters)} 章节: {start_ch} → {end_ch}")
+            predictions = predict_chapters(selected_novel, batch_chapters)
+            predicted = {ch: predictions[ch]["llm"] + predictions[ch]["tts"] for ch in batch_chapters}
+            st.write(f"将处理 {len(batch_chapters)} 章节: {start_ch} → {end_ch}，"
+                     f"预计耗时 {format_duration(sum(predicted.values()))}")
 
             # 批量生成按钮
             if st.button("🔁 批量生成选中章节"):
                 progress_bar = st.progress(0)
                 status_text = st.empty()
+                progress = BatchProgress(predicted, {ch: predictions[ch]["chars"] for ch in batch_chapters})
                 for i, ch in enumerate(batch_chapters):
-                    status_text.text(f"正在处理 {ch} ({i+1}/{len(batch_chapters)})...")
-                    progress_bar.progress((i + 1) / len(batch_chapters))
+                    # 每章开始前检查用量预算：接近时降速，达到时停止
+                    try:
+                        enforce_budget(selected_novel)
+                    except BudgetExceeded as e:
+                        st.error(f"⛔ {e}，剩余 {len(batch_chapters) - i} 章未处理")
+                        break
+                    status_text.text(f"正在处理 {ch} ({i+1}/{len(batch_chapters)})... {progress.summary()}")
+                    # 进度条按预测耗时而非章节数推进
+                    done_predicted = sum(predicted[c] for c in batch_chapters[:i])
+                    progress_bar.progress(done_predicted / max(sum(predicted.values()), 1e-9))
+                    ch_start = time.monotonic()
                     try:
                         convert_novel_to_script(selected_novel, ch)
                         manage_characters(selected_novel, ch)
                         sync_role_to_voice(selected_novel)
                         generate_tts_audio(selected_novel, ch)
+                        progress.finish(ch, time.monotonic() - ch_start)
                     except Exception as e:
                         st.warning(f"⚠️ {ch} 生成失败: {e}")
+                progress_bar.progress(1.0)
                 status_text.text("✅ 批量生成完成！")
                 st.rerun()
 
@@ -182,6 +243,19 @@ with tab2:
             else:
                 st.info("所选章节中暂无已生成的音频，无法批量下载。")
 
+        # --- 整本导出 ---
+        st.divider()
+        st.subheader("📚 导出整本有声书")
+        export_format = st.selectbox("导出格式", ["m4b", "mka", "flac", "wav"], key="export_format",
+                                     help="m4b/mka 内嵌章节标记，flac/wav 附带 .cue 索引；仅重新编码音频有变化的章节")
+        if st.button("📚 导出整本"):
+            with st.spinner("正在导出，请稍候..."):
+                try:
+                    book_path = export_audiobook(selected_novel, fmt=export_format)
+                    st.success(f"✅ 导出完成: {book_path}")
+                except Exception as e:
+                    st.error(f"❌ 导出失败: {e}")
+
 # --- Tab 3: 自定义音色 ---
 with tab3:
     if not selected_novel:
@@ -211,4 +285,37 @@ with tab3:
             with open(role_to_voice_path, "w", encoding="utf-8") as f:
                 json.dump(role_map, f, ensure_ascii=False, indent=2)
 
-            st.success(f"✅ 角色 [{role_name}] 音色已绑定到 `{voice_filename}`")
\ No newline at end of file
+            st.success(f"✅ 角色 [{role_name}] 音色已绑定到 `{voice_filename}`")
+
+# --- Tab 4: API 用量 ---
+with tab4:
+    st.subheader("📊 API 用量")
+    days = st.number_input("统计最近天数（0 表示全部）", min_value=0, value=30, step=1)
+    days = int(days) or None
+
+    by_novel = summarize(["novel"], days=days)
+    if not by_novel:
+        st.info("暂无用量记录")
+    else:
+        st.write("按小说汇总")
+        st.dataframe(by_novel, use_container_width=True)
+        st.write("按日期汇总")
+        st.dataframe(summarize(["day"], days=days), use_container_width=True)
+
+        if selected_novel:
+            st.divider()
+            st.write(f"小说 [{selected_novel}]")
+            for s in budget_status(selected_novel):
+                st.progress(min(s["ratio"], 1.0), text=f"预算 {s['name']}: {s['used']:g} / {s['limit']:g}")
+            st.dataframe(summarize(["stage", "model"], selected_novel, days), use_container_width=True)
+            st.dataframe(summarize(["chapter", "stage"], selected_novel, days), use_container_width=True)
+
+    accuracy = prediction_accuracy()
+    if accuracy:
+        st.divider()
+        st.write("⏱️ 耗时预测准确度（最近运行）")
+        st.dataframe(
+            [{"阶段": stage, "次数": a["runs"], "平均误差": f"{a['mape']:.0%}", "实际/预测": round(a["bias"], 2)}
+             for stage, a in accuracy.items()],
+            use_container_width=True
+        )